@@ -0,0 +1,11 @@
+"""Nearest-rank percentiles, shared by the server's latency recorders and the load/benchmark scripts."""
+
+import math
+
+
+def percentile(ordered, pct):
+    """Nearest-rank ``pct`` percentile of an already sorted sequence; 0.0 when it is empty."""
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
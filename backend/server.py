@@ -1,8 +1,15 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, IndexModel, UpdateMany, UpdateOne
+from pymongo import WriteConcern, monitoring
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from bson import CodecOptions, decode_file_iter
+from bson.raw_bson import RawBSONDocument
 import os
 import logging
 from pathlib import Path
@@ -12,23 +19,464 @@ import uuid
 from datetime import datetime, timedelta
 import random
 import asyncio
+import gzip
+import hashlib
+import math
+import bisect
+from array import array
+import heapq
+import itertools
+import socket
+import time
+from collections import Counter, OrderedDict, defaultdict, deque
+from contextlib import asynccontextmanager
+import httpx
+import numpy as np
 import openai
-from openai import OpenAI
+from openai import AsyncOpenAI
+from openai.types import CompletionUsage
+from openai.types.chat import ChatCompletion, ChatCompletionChunk, ChatCompletionMessage
+from openai.types.chat.chat_completion import Choice
+from openai.types.chat.chat_completion_chunk import Choice as ChunkChoice, ChoiceDelta
 import json
+import orjson
+import queue
+import threading
+import logging.handlers
+
+from percentiles import percentile
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Metrics, rendered in the Prometheus text format at /api/metrics
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+METRICS = []
+
+def format_labels(names, values) -> str:
+    if not names:
+        return ""
+    escaped = (
+        str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        for value in values
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+class MetricCounter:
+    kind = "counter"
+    
+    def __init__(self, name: str, help_text: str, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.series: Dict[tuple, float] = {}
+        # Mongo command events arrive on Motor's executor threads
+        self.lock = threading.Lock()
+        METRICS.append(self)
+    
+    def inc(self, amount: float = 1, *labels):
+        with self.lock:
+            self.series[labels] = self.series.get(labels, 0) + amount
+    
+    def samples(self):
+        with self.lock:
+            series = list(self.series.items())
+        for labels, value in series:
+            yield f"{self.name}{format_labels(self.labelnames, labels)} {value}"
+    
+    def render(self) -> str:
+        header = f"# HELP {self.name} {self.help_text}\n# TYPE {self.name} {self.kind}\n"
+        return header + "".join(f"{line}\n" for line in self.samples())
+
+class MetricGauge(MetricCounter):
+    kind = "gauge"
+    
+    def dec(self, amount: float = 1, *labels):
+        self.inc(-amount, *labels)
+
+class MetricHistogram(MetricCounter):
+    kind = "histogram"
+    
+    def __init__(self, name: str, help_text: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+    
+    def observe(self, value: float, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                # Per-bucket counts (last slot is +Inf), then sum and count
+                series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+    
+    def samples(self):
+        with self.lock:
+            series = [(labels, list(counts), total, count) for labels, (counts, total, count) in self.series.items()]
+        names = self.labelnames + ("le",)
+        for labels, counts, total, count in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                yield f"{self.name}_bucket{format_labels(names, labels + (le,))} {cumulative}"
+            yield f"{self.name}_sum{format_labels(self.labelnames, labels)} {total}"
+            yield f"{self.name}_count{format_labels(self.labelnames, labels)} {count}"
+
+def render_metrics() -> str:
+    return "".join(metric.render() for metric in METRICS)
+
+http_request_seconds = MetricHistogram(
+    "http_request_duration_seconds", "HTTP request latency by route template", ("method", "route")
+)
+http_requests_total = MetricCounter(
+    "http_requests_total", "HTTP requests by route template and status", ("method", "route", "status")
+)
+http_requests_in_flight = MetricGauge(
+    "http_requests_in_flight", "HTTP requests (including open streams) currently being served", ("method",)
+)
+mongo_command_seconds = MetricHistogram(
+    "mongodb_command_duration_seconds", "MongoDB command latency by collection", ("command", "collection")
+)
+mongo_command_failures = MetricCounter(
+    "mongodb_command_failures_total", "Failed MongoDB commands by collection", ("command", "collection")
+)
+llm_request_seconds = MetricHistogram(
+    "llm_request_duration_seconds", "Chat completion latency, start to last token", ("endpoint", "outcome")
+)
+llm_first_token_seconds = MetricHistogram(
+    "llm_first_token_seconds", "Streaming chat completion time to first token", ("endpoint",)
+)
+llm_tokens_total = MetricCounter(
+    "llm_tokens_total", "Tokens reported by the completion API", ("endpoint", "kind")
+)
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Times every driver command per collection; the collection is only on the started event."""
+    
+    def __init__(self):
+        self.pending: Dict[tuple, str] = {}
+    
+    def started(self, event):
+        target = event.command.get("collection" if event.command_name == "getMore" else event.command_name)
+        self.pending[(event.connection_id, event.request_id)] = target if isinstance(target, str) else "-"
+    
+    def succeeded(self, event):
+        self.observe(event)
+    
+    def failed(self, event):
+        collection = self.observe(event)
+        mongo_command_failures.inc(1, event.command_name, collection)
+    
+    def observe(self, event) -> str:
+        collection = self.pending.pop((event.connection_id, event.request_id), "-")
+        mongo_command_seconds.observe(event.duration_micros / 1e6, event.command_name, collection)
+        return collection
+
+class MetricsMiddleware:
+    """Pure ASGI middleware, so streamed responses pass through untouched.
+    
+    Requests are labelled with the matched route template (``scope["route"]``) rather than the raw
+    path, which keeps the series count bounded; SSE routes are timed until the stream closes.
+    """
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        method = scope["method"]
+        status = 500
+        
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+        
+        started = time.perf_counter()
+        http_requests_in_flight.inc(1, method)
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            http_requests_in_flight.dec(1, method)
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            http_request_seconds.observe(time.perf_counter() - started, method, path)
+            http_requests_total.inc(1, method, path, str(status))
+
+def record_llm_call(endpoint: str, seconds: float, outcome: str, usage=None):
+    llm_request_seconds.observe(seconds, endpoint, outcome)
+    if usage is not None:
+        llm_tokens_total.inc(usage.prompt_tokens or 0, endpoint, "prompt")
+        llm_tokens_total.inc(usage.completion_tokens or 0, endpoint, "completion")
+
+mongo_metrics = MongoCommandMetrics()
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, event_listeners=[mongo_metrics])
 db = client[os.environ['DB_NAME']]
 
 # OpenAI client with dummy key for now
-openai_client = OpenAI(api_key=os.environ.get('OPENAI_API_KEY', 'sk-dummy-key-replace-with-real-key'))
+# Async client on a shared connection pool so LLM round trips never block the event loop
+openai_http_client = httpx.AsyncClient(
+    limits=httpx.Limits(
+        max_connections=int(os.environ.get('OPENAI_MAX_CONNECTIONS', '100')),
+        max_keepalive_connections=int(os.environ.get('OPENAI_MAX_KEEPALIVE_CONNECTIONS', '20'))
+    ),
+    timeout=httpx.Timeout(float(os.environ.get('OPENAI_TIMEOUT', '60')), connect=5.0)
+)
+openai_client = AsyncOpenAI(
+    api_key=os.environ.get('OPENAI_API_KEY', 'sk-dummy-key-replace-with-real-key'),
+    http_client=openai_http_client,
+    # Retries are done by create_completion, inside the request deadline and the circuit breaker
+    max_retries=0
+)
+
+# Completion backend: "openai" calls the API above, "local" is an offline deterministic stand-in
+LLM_BACKEND = os.environ.get('LLM_BACKEND', 'openai')
+LLM_LOCAL_LATENCY = float(os.environ.get('LLM_LOCAL_LATENCY', '0'))  # seconds before the first token
+LLM_LOCAL_TOKEN_INTERVAL = float(os.environ.get('LLM_LOCAL_TOKEN_INTERVAL', '0'))  # seconds between tokens
+LLM_LOCAL_TOKENS = int(os.environ.get('LLM_LOCAL_TOKENS', '60'))
+LLM_LOCAL_ERROR_RATE = float(os.environ.get('LLM_LOCAL_ERROR_RATE', '0'))  # injected connection failures
+
+class OpenAICompletionBackend:
+    name = "openai"
+
+    def __init__(self, client: AsyncOpenAI):
+        self.client = client
+
+    async def create(self, **params):
+        return await self.client.chat.completions.create(**params)
+
+    async def close(self):
+        pass  # openai_client is module-level and closed on shutdown
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name, "base_url": str(self.client.base_url)}
+
+class LocalCompletionBackend:
+    """Answers without any network I/O, returning the same response and chunk types as the SDK.
+
+    The reply is a pure function of the messages, so repeated runs are comparable; latency, length
+    and failure rate are configurable to model a real provider.
+    """
+    name = "local"
+    WORDS = (
+        "your", "portfolio", "shows", "steady", "growth", "in", "technology", "holdings", "while",
+        "energy", "positions", "remain", "volatile", "consider", "rebalancing", "toward", "diversified",
+        "index", "funds", "and", "reviewing", "stop", "loss", "levels", "before", "the", "next",
+        "earnings", "season", "market", "momentum", "favors", "large", "cap", "names", "today"
+    )
+
+    def __init__(self, latency: float = 0.0, token_interval: float = 0.0, tokens: int = 60,
+                 error_rate: float = 0.0, seed: int = 42):
+        self.latency = latency
+        self.token_interval = token_interval
+        self.tokens = tokens
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.calls = 0
+        self.failures = 0
+
+    def reply_tokens(self, messages: List[Dict[str, str]], max_tokens: Optional[int]) -> List[str]:
+        digest = hashlib.sha256("\x1f".join(message["content"] for message in messages).encode()).digest()
+        rng = random.Random(digest)
+        count = min(self.tokens, max_tokens or self.tokens)
+        return [("" if index == 0 else " ") + rng.choice(self.WORDS) for index in range(count)]
+
+    def usage(self, messages: List[Dict[str, str]], tokens: List[str]) -> CompletionUsage:
+        # Roughly four characters per token, like the real tokenizer on English text
+        prompt_tokens = sum(len(message["content"]) for message in messages) // 4
+        return CompletionUsage(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=len(tokens),
+            total_tokens=prompt_tokens + len(tokens)
+        )
+
+    async def create(self, messages: List[Dict[str, str]], model: str = "local", stream: bool = False,
+                     max_tokens: Optional[int] = None, stream_options: Optional[Dict] = None, **params):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        if self.error_rate and self.rng.random() < self.error_rate:
+            self.failures += 1
+            raise openai.APIConnectionError(request=httpx.Request("POST", "local://chat/completions"))
+        tokens = self.reply_tokens(messages, max_tokens)
+        completion_id = f"chatcmpl-local-{self.calls}"
+        created = int(time.time())
+        if stream:
+            include_usage = bool(stream_options and stream_options.get("include_usage"))
+            return self.stream(completion_id, created, model, messages, tokens, include_usage)
+        return ChatCompletion(
+            id=completion_id,
+            object="chat.completion",
+            created=created,
+            model=model,
+            choices=[Choice(
+                index=0,
+                finish_reason="stop",
+                message=ChatCompletionMessage(role="assistant", content="".join(tokens))
+            )],
+            usage=self.usage(messages, tokens)
+        )
+
+    async def stream(self, completion_id: str, created: int, model: str, messages: List[Dict[str, str]],
+                     tokens: List[str], include_usage: bool):
+        for index, token in enumerate(tokens):
+            if index:
+                await asyncio.sleep(self.token_interval)
+            yield ChatCompletionChunk(
+                id=completion_id,
+                object="chat.completion.chunk",
+                created=created,
+                model=model,
+                choices=[ChunkChoice(index=0, delta=ChoiceDelta(content=token), finish_reason=None)]
+            )
+        if include_usage:
+            yield ChatCompletionChunk(
+                id=completion_id,
+                object="chat.completion.chunk",
+                created=created,
+                model=model,
+                choices=[],
+                usage=self.usage(messages, tokens)
+            )
+
+    async def close(self):
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.name,
+            "latency": self.latency,
+            "token_interval": self.token_interval,
+            "tokens": self.tokens,
+            "error_rate": self.error_rate,
+            "calls": self.calls,
+            "injected_failures": self.failures
+        }
+
+def make_completion_backend(name: str):
+    if name == "openai":
+        return OpenAICompletionBackend(openai_client)
+    if name == "local":
+        return LocalCompletionBackend(LLM_LOCAL_LATENCY, LLM_LOCAL_TOKEN_INTERVAL, LLM_LOCAL_TOKENS, LLM_LOCAL_ERROR_RATE)
+    raise ValueError(f"Unknown LLM_BACKEND: {name}")
+
+completion_backend = make_completion_backend(LLM_BACKEND)
+
+# Completion parameters shared by the buffered and streaming chat endpoints
+CHAT_MODEL_PARAMS = {
+    "model": "gpt-4o",
+    "max_tokens": 500,
+    "temperature": 0.7
+}
+
+# LLM call protection: bounded concurrency with a bounded wait queue, retries inside a per-request
+# deadline, and a circuit breaker that fails fast while the provider is down
+LLM_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', '20'))
+LLM_MAX_QUEUE = int(os.environ.get('LLM_MAX_QUEUE', '50'))
+LLM_DEADLINE = float(os.environ.get('LLM_DEADLINE', '20'))
+LLM_MAX_RETRIES = int(os.environ.get('LLM_MAX_RETRIES', '2'))
+LLM_RETRY_BASE_DELAY = float(os.environ.get('LLM_RETRY_BASE_DELAY', '0.25'))
+LLM_RETRY_MAX_DELAY = float(os.environ.get('LLM_RETRY_MAX_DELAY', '4'))
+LLM_BREAKER_FAILURES = int(os.environ.get('LLM_BREAKER_FAILURES', '5'))
+LLM_BREAKER_COOLDOWN = float(os.environ.get('LLM_BREAKER_COOLDOWN', '30'))
+
+# Startup dataset handling: "reset" reseeds on every boot (single worker only),
+# "if_missing" seeds once per dataset version, "restore" loads the BSON snapshot in SNAPSHOT_PATH
+STARTUP_SEED_MODE = os.environ.get('STARTUP_SEED_MODE', 'if_missing')
+SNAPSHOT_PATH = Path(os.environ.get('SNAPSHOT_PATH', str(ROOT_DIR / 'snapshot')))
+SEED_LOCK_TTL = float(os.environ.get('SEED_LOCK_TTL', '60'))
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+# Chat response cache configuration
+CHAT_CACHE_ENABLED = os.environ.get('CHAT_CACHE_ENABLED', 'true').lower() == 'true'
+CHAT_CACHE_TTL = float(os.environ.get('CHAT_CACHE_TTL', '300'))
+CHAT_CACHE_MAX_ENTRIES = int(os.environ.get('CHAT_CACHE_MAX_ENTRIES', '10000'))
+# Share cached completions across workers through a Mongo collection
+CHAT_CACHE_SHARED = os.environ.get('CHAT_CACHE_SHARED', 'false').lower() == 'true'
+
+# Bearer token -> user cache configuration
+AUTH_CACHE_TTL = float(os.environ.get('AUTH_CACHE_TTL', '30'))
+AUTH_CACHE_MAX_ENTRIES = int(os.environ.get('AUTH_CACHE_MAX_ENTRIES', '10000'))
+
+# Gzip for the composite dashboard payload (per endpoint: a GZipMiddleware would buffer the SSE feeds)
+DASHBOARD_GZIP_MIN_SIZE = int(os.environ.get('DASHBOARD_GZIP_MIN_SIZE', '1024'))
+DASHBOARD_GZIP_LEVEL = int(os.environ.get('DASHBOARD_GZIP_LEVEL', '5'))
+
+# Per-user chat context (user document, holdings and the prebuilt context line); trades on the user drop it
+CHAT_CONTEXT_TTL = float(os.environ.get('CHAT_CONTEXT_TTL', '30'))
+CHAT_CONTEXT_MAX_ENTRIES = int(os.environ.get('CHAT_CONTEXT_MAX_ENTRIES', '10000'))
+
+# Seconds a stock snapshot may be served before reloading; bounds staleness when another
+# worker writes prices (writes in this process invalidate the snapshot immediately)
+STOCK_SNAPSHOT_MAX_AGE = float(os.environ.get('STOCK_SNAPSHOT_MAX_AGE', '5'))
+
+# Market price simulation (geometric Brownian motion over all symbols at once)
+PRICE_ENGINE_ENABLED = os.environ.get('PRICE_ENGINE_ENABLED', 'false').lower() == 'true'
+PRICE_TICK_INTERVAL = float(os.environ.get('PRICE_TICK_INTERVAL', '1.0'))
+PRICE_ENGINE_SEED = int(os.environ.get('PRICE_ENGINE_SEED', '7'))
+PRICE_VOLATILITY = float(os.environ.get('PRICE_VOLATILITY', '0.3'))  # annualized
+PRICE_DRIFT = float(os.environ.get('PRICE_DRIFT', '0.05'))  # annualized
+# Simulated market seconds per wall-clock second, so prices move visibly in a demo
+PRICE_TIME_SCALE = float(os.environ.get('PRICE_TIME_SCALE', '60'))
+
+# Push feed limits: subscribers per worker, seconds between keepalives, and how long a
+# consumer may leave updates undrained before it is disconnected
+PUSH_MAX_SUBSCRIBERS = int(os.environ.get('PUSH_MAX_SUBSCRIBERS', '10000'))
+PUSH_HEARTBEAT_INTERVAL = float(os.environ.get('PUSH_HEARTBEAT_INTERVAL', '15'))
+PUSH_STALL_TIMEOUT = float(os.environ.get('PUSH_STALL_TIMEOUT', '30'))
+
+# Write-behind buffering of single /trade inserts into insert_many batches
+TRADE_WRITE_BEHIND = os.environ.get('TRADE_WRITE_BEHIND', 'false').lower() == 'true'
+# true: respond once the batch holding the trade is acknowledged; false: respond as soon as it is queued
+TRADE_WRITE_BEHIND_WAIT = os.environ.get('TRADE_WRITE_BEHIND_WAIT', 'true').lower() == 'true'
+TRADE_BATCH_MAX_SIZE = int(os.environ.get('TRADE_BATCH_MAX_SIZE', '500'))
+TRADE_BATCH_MAX_DELAY = float(os.environ.get('TRADE_BATCH_MAX_DELAY', '0.01'))
+
+# Seconds between re-syncs of the in-memory collection counters with Mongo's collection metadata
+COUNTER_RECONCILE_INTERVAL = float(os.environ.get('COUNTER_RECONCILE_INTERVAL', '60'))
+
+# Seconds between pulls of alerts created on other workers into the alert engine
+ALERT_SYNC_INTERVAL = float(os.environ.get('ALERT_SYNC_INTERVAL', '5'))
+
+# Logging pipeline: records are queued on the request path and formatted/written on a listener thread
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')  # json | text
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', '10000'))
+# Per-event sampling ("chat_prompt=0.1,auth=0.5") and per-second rate limits ("auth=50,trade=100")
+LOG_SAMPLE_RATES = os.environ.get('LOG_SAMPLE_RATES', '')
+LOG_RATE_LIMITS = os.environ.get('LOG_RATE_LIMITS', 'auth=50,chat=50,chat_prompt=20,login=50,trade=100')
+
+# JSON rendering shared by responses, snapshots and streams
+def orjson_default(value):
+    # orjson covers dict/list/str/numbers/datetime/UUID/numpy natively; anything else (ObjectId,
+    # pydantic models) goes through FastAPI's encoder
+    return jsonable_encoder(value)
+
+def dump_json(content) -> bytes:
+    return orjson.dumps(content, default=orjson_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+
+class FastJSONResponse(Response):
+    """JSON response rendered by orjson.
+
+    Returned directly from a handler it also skips FastAPI's ``jsonable_encoder`` walk; as the
+    app's default response class it only replaces the final ``json.dumps``.
+    """
+    media_type = "application/json"
+    
+    def render(self, content: Any) -> bytes:
+        return dump_json(content)
 
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(default_response_class=FastJSONResponse)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -84,195 +532,1726 @@ class Alert(BaseModel):
     is_active: bool = True
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
-class ChatMessage(BaseModel):
-    message: str
-    user_id: Optional[str] = None
-    session_token: Optional[str] = None
+class ChatMessage(BaseModel):
+    message: str
+    user_id: Optional[str] = None
+    session_token: Optional[str] = None
+
+class LoginRequest(BaseModel):
+    username: str
+    password: str
+
+class TradeBatchRequest(BaseModel):
+    orders: List[Dict[str, Any]]
+
+class AlertRequest(BaseModel):
+    stock_symbol: str
+    alert_type: str  # stop_loss, target
+    trigger_price: float
+    user_id: Optional[str] = None
+
+class OrderRequest(BaseModel):
+    stock_symbol: str
+    side: str  # buy, sell
+    order_type: str = "limit"  # limit, market
+    quantity: int
+    price: Optional[float] = None
+    user_id: Optional[str] = None
+
+# VULNERABLE: Weak authentication function
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    if not credentials:
+        return None
+    
+    # VULNERABILITY: Check token against database but with weak validation
+    token = credentials.credentials
+    started = time.perf_counter()
+    user = token_cache.get(token)
+    if user is None:
+        user = await db.users.find_one({"api_token": token}, {"_id": 0})
+        if user:
+            token_cache.set(token, user)
+        auth_miss_latency.record(time.perf_counter() - started)
+    else:
+        auth_hit_latency.record(time.perf_counter() - started)
+    
+    # VULNERABILITY: Logs contain sensitive information
+    logging.info("Authentication attempt with token: %s", token, extra={"event": "auth"})
+    if user:
+        logging.info("User authenticated: %s with role: %s", user['username'], user['role'], extra={"event": "auth"})
+    
+    return serialize_doc(user)
+
+def invalidate_user_cache(user_id: Optional[str] = None):
+    """Drop cached token lookups for ``user_id``, or for every user when it is omitted.
+
+    Call this after any write to a user document (role, balance, token, deletion).
+    """
+    if user_id is None:
+        token_cache.clear()
+        chat_context.invalidate()
+        return
+    # A scan rather than a user -> token index, which would grow with every user ever seen
+    token_cache.pop_where(lambda user: user['id'] == user_id)
+    chat_context.invalidate(user_id)
+
+# Helper function to convert MongoDB documents to JSON-serializable format
+def serialize_doc(doc):
+    if doc is None:
+        return None
+    if isinstance(doc, list):
+        return [serialize_doc(item) for item in doc]
+    if isinstance(doc, dict):
+        serialized = {}
+        for key, value in doc.items():
+            if key == '_id':
+                continue  # Skip MongoDB ObjectId
+            serialized[key] = serialize_doc(value)
+        return serialized
+    return doc
+
+def project_doc(doc):
+    """Drop the top-level ``_id`` Mongo adds when a query did not project it away.
+
+    Unlike ``serialize_doc`` nothing is copied or walked recursively: documents read with an
+    ``{"_id": 0}`` projection pass straight through, so this costs one dict lookup per row.
+    """
+    if isinstance(doc, list):
+        for item in doc:
+            if isinstance(item, dict):
+                item.pop('_id', None)
+    elif isinstance(doc, dict):
+        doc.pop('_id', None)
+    return doc
+
+# Page sizes for keyset-paginated listings
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+NDJSON_CHUNK_DOCS = 200
+
+async def keyset_page(collection, query: Dict[str, Any], sort_key: str, limit: int, after: Optional[str] = None):
+    """One page of ``collection`` ordered by the unique ``sort_key``, starting after ``after``.
+
+    Returns ``(items, next_cursor)``; ``next_cursor`` is None on the last page. Seeking on the
+    indexed key keeps every page equally cheap, unlike skip/limit.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    if after is not None:
+        query = {**query, sort_key: {"$gt": after}}
+    items = await collection.find(query, {"_id": 0}).sort(sort_key, ASCENDING).limit(limit + 1).to_list(limit + 1)
+    next_cursor = items[limit - 1][sort_key] if len(items) > limit else None
+    return items[:limit], next_cursor
+
+def ndjson_stream(docs) -> StreamingResponse:
+    """Stream the documents of an async iterable as newline-delimited JSON, a chunk at a time."""
+    async def lines():
+        chunk = []
+        async for doc in docs:
+            chunk.append(dump_json(doc))
+            if len(chunk) >= NDJSON_CHUNK_DOCS:
+                yield b"\n".join(chunk) + b"\n"
+                chunk = []
+        if chunk:
+            yield b"\n".join(chunk) + b"\n"
+    
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+def ndjson_response(collection, query: Dict[str, Any], sort_key: str, after: Optional[str] = None) -> StreamingResponse:
+    """Stream every matching document as newline-delimited JSON straight off the Motor cursor."""
+    if after is not None:
+        query = {**query, sort_key: {"$gt": after}}
+    return ndjson_stream(collection.find(query, {"_id": 0}).sort(sort_key, ASCENDING).batch_size(NDJSON_CHUNK_DOCS))
+
+class TTLCache:
+    """Size-bounded LRU cache whose entries expire ``ttl`` seconds after being set."""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key, default=None):
+        entry = self._entries.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def pop_where(self, predicate) -> int:
+        """Drop every entry whose value matches ``predicate``; a full scan, meant for rare invalidations."""
+        keys = [key for key, (_, value) in self._entries.items() if predicate(value)]
+        for key in keys:
+            del self._entries[key]
+        return len(keys)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions
+        }
+
+class LatencyRecorder:
+    """Keeps the most recent ``size`` latency samples (in seconds) for percentile reporting."""
+
+    def __init__(self, size: int = 10000):
+        self.samples = deque(maxlen=size)
+        self.count = 0
+        self.total = 0.0
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+        self.count += 1
+        self.total += seconds
+
+    def percentile(self, pct: float) -> float:
+        return percentile(sorted(self.samples), pct)
+
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "mean_ms": round(self.mean() * 1000, 3),
+            "p50_ms": round(self.percentile(50) * 1000, 3),
+            "p99_ms": round(self.percentile(99) * 1000, 3)
+        }
+
+class ChatResponseCache:
+    """Exact-match cache of chat completions keyed on the normalized prompt and model parameters.
+
+    Entries live in a local TTLCache; when ``collection`` is given they are also written to
+    Mongo so every worker can serve completions another worker already paid for.
+    """
+
+    def __init__(self, cache: TTLCache, collection=None):
+        self.cache = cache
+        self.collection = collection
+        self.shared_hits = 0
+        self.saved_seconds = 0.0
+        self.saved_tokens = 0
+
+    @staticmethod
+    def make_key(system_prompt: str, message: str, params: Dict[str, Any]) -> str:
+        normalized = json.dumps({
+            "system_prompt": " ".join(system_prompt.split()),
+            "message": " ".join(message.split()),
+            "params": params
+        }, sort_keys=True)
+        return hashlib.sha256(normalized.encode()).hexdigest()
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self.cache.get(key)
+        if entry is None and self.collection is not None:
+            try:
+                entry = await self.collection.find_one(
+                    {"_id": key, "expires_at": {"$gt": datetime.utcnow()}},
+                    {"_id": 0, "response": 1, "latency": 1, "total_tokens": 1}
+                )
+            except Exception as e:
+                logging.warning("Shared chat cache lookup failed: %s", e, extra={"event": "chat_cache"})
+                entry = None
+            if entry is not None:
+                # Counted as a miss by the local cache, so move it over to the hit column
+                self.cache.misses -= 1
+                self.cache.hits += 1
+                self.shared_hits += 1
+                self.cache.set(key, entry)
+        if entry is not None:
+            self.saved_seconds += entry.get("latency") or 0.0
+            self.saved_tokens += entry.get("total_tokens") or 0
+        return entry
+
+    async def set(self, key: str, response: str, latency: float, total_tokens: Optional[int] = None):
+        entry = {"response": response, "latency": latency, "total_tokens": total_tokens}
+        self.cache.set(key, entry)
+        if self.collection is not None:
+            try:
+                await self.collection.replace_one(
+                    {"_id": key},
+                    {**entry, "expires_at": datetime.utcnow() + timedelta(seconds=self.cache.ttl)},
+                    upsert=True
+                )
+            except Exception as e:
+                logging.warning("Shared chat cache write failed: %s", e, extra={"event": "chat_cache"})
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.cache.stats(),
+            "enabled": CHAT_CACHE_ENABLED,
+            "shared": self.collection is not None,
+            "shared_hits": self.shared_hits,
+            "saved_llm_seconds": round(self.saved_seconds, 3),
+            "saved_tokens": self.saved_tokens
+        }
+
+token_cache = TTLCache(AUTH_CACHE_MAX_ENTRIES, AUTH_CACHE_TTL)
+auth_hit_latency = LatencyRecorder()
+auth_miss_latency = LatencyRecorder()
+
+class ChatContextService:
+    """Caches what the chat endpoints know about a user: the user document, their holdings and the
+    ``user_context`` line for the system prompt, loaded with one concurrent round trip.
+
+    Concurrent misses for the same user share a single load. Entries expire after ``ttl`` and are
+    dropped by ``invalidate`` whenever the user trades or their document changes.
+    """
+
+    def __init__(self, cache: TTLCache):
+        self.cache = cache
+        self.loading: Dict[str, asyncio.Future] = {}
+        self.hit_latency = LatencyRecorder()
+        self.miss_latency = LatencyRecorder()
+
+    @staticmethod
+    def format_context(user: Dict[str, Any]) -> str:
+        return f"User: {user['username']} (Role: {user['role']}, Balance: ${user['balance']})"
+
+    async def get(self, user_id: str) -> Optional[Dict[str, Any]]:
+        started = time.perf_counter()
+        entry = self.cache.get(user_id)
+        if entry is not None:
+            self.hit_latency.record(time.perf_counter() - started)
+            return entry
+        
+        pending = self.loading.get(user_id)
+        if pending is None:
+            pending = self.loading[user_id] = asyncio.ensure_future(self._load(user_id))
+            pending.add_done_callback(lambda done: self._loaded(user_id, done))
+        entry = await asyncio.shield(pending)
+        self.miss_latency.record(time.perf_counter() - started)
+        return entry
+
+    async def _load(self, user_id: str) -> Optional[Dict[str, Any]]:
+        user, holdings = await asyncio.gather(
+            db.users.find_one({"id": user_id}, {"_id": 0}),
+            db.portfolios.find({"user_id": user_id}, {"_id": 0}).to_list(100)
+        )
+        if user is None:
+            return None
+        entry = {"user": user, "holdings": holdings, "context": self.format_context(user)}
+        # An invalidation that raced this load wins: only cache if this load is still the current one
+        if self.loading.get(user_id) is asyncio.current_task():
+            self.cache.set(user_id, entry)
+        return entry
+
+    def _loaded(self, user_id: str, done: asyncio.Future):
+        if self.loading.get(user_id) is done:
+            del self.loading[user_id]
+
+    def invalidate(self, user_id: Optional[str] = None):
+        if user_id is None:
+            self.cache.clear()
+            self.loading.clear()
+            return
+        self.cache.pop(user_id)
+        self.loading.pop(user_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.cache.stats(),
+            "loading": len(self.loading),
+            "hit_latency": self.hit_latency.summary(),
+            "miss_latency": self.miss_latency.summary()
+        }
+
+chat_context = ChatContextService(TTLCache(CHAT_CONTEXT_MAX_ENTRIES, CHAT_CONTEXT_TTL))
+
+def invalidate_trading_users(trades: List[Dict[str, Any]]):
+    for user_id in {trade["user_id"] for trade in trades}:
+        chat_context.invalidate(user_id)
+
+chat_cache = ChatResponseCache(
+    TTLCache(CHAT_CACHE_MAX_ENTRIES, CHAT_CACHE_TTL),
+    db.chat_cache if CHAT_CACHE_SHARED else None
+)
+
+class StockSnapshot:
+    """Versioned, pre-serialized copy of the stocks collection for the /stocks endpoints.
+
+    Writers call ``invalidate()``; the next reader reloads the table once and every other
+    request is answered from the cached bytes. ETags are content hashes, so they agree
+    across workers holding the same data.
+    """
+
+    def __init__(self, max_age: float):
+        self.max_age = max_age
+        self.version = 0
+        self.loaded_version = -1
+        self.loaded_at = 0.0
+        self.body = b"[]"
+        self.etag = ""
+        self.by_symbol: Dict[str, tuple] = {}  # symbol -> (body, etag)
+        self._lock = asyncio.Lock()
+
+    def invalidate(self):
+        self.version += 1
+
+    def is_stale(self) -> bool:
+        return (
+            self.loaded_version != self.version
+            or (self.max_age > 0 and time.monotonic() - self.loaded_at > self.max_age)
+        )
+
+    async def get(self) -> "StockSnapshot":
+        if self.is_stale():
+            async with self._lock:
+                if self.is_stale():
+                    await self._load()
+        return self
+
+    async def _load(self):
+        version = self.version
+        stocks = jsonable_encoder(await db.stocks.find({}, {"_id": 0}).to_list(None))
+        by_symbol = {}
+        for stock in stocks:
+            body = dump_json(stock)
+            by_symbol[stock["symbol"]] = (body, make_etag(body))
+        self.body = dump_json(stocks)
+        self.etag = make_etag(self.body)
+        self.by_symbol = by_symbol
+        self.loaded_version = version
+        self.loaded_at = time.monotonic()
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.sha1(body).hexdigest() + '"'
+
+def etag_response(request: Request, body: bytes, etag: str) -> Response:
+    """Serve ``body`` with its ETag, or an empty 304 when the client already holds it."""
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        client_etags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        if etag in client_etags or "*" in client_etags:
+            return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+stock_snapshot = StockSnapshot(STOCK_SNAPSHOT_MAX_AGE)
+
+# Indexes backing every hot query path; create_indexes is a no-op for indexes that already exist
+COLLECTION_INDEXES = {
+    "users": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("api_token", ASCENDING)], name="api_token_unique", unique=True),
+        IndexModel([("username", ASCENDING)], name="username_unique", unique=True)
+    ],
+    "stocks": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("symbol", ASCENDING)], name="symbol_unique", unique=True)
+    ],
+    "portfolios": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("user_id", ASCENDING), ("stock_symbol", ASCENDING)], name="user_id_stock_symbol")
+    ],
+    "trades": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("user_id", ASCENDING), ("timestamp", DESCENDING)], name="user_id_timestamp")
+    ],
+    "alerts": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("stock_symbol", ASCENDING), ("is_active", ASCENDING)], name="stock_symbol_is_active"),
+        IndexModel([("user_id", ASCENDING)], name="user_id"),
+        IndexModel([("is_active", ASCENDING), ("created_at", ASCENDING)], name="is_active_created_at")
+    ]
+}
+
+# Representative query for each endpoint: (endpoint, collection, filter, full_scan_expected)
+QUERY_PLAN_CHECKS = [
+    ("get_current_user", "users", {"api_token": "token_probe"}, False),
+    ("login", "users", {"username": "probe_user"}, False),
+    ("chat_with_ai", "users", {"id": "probe_id"}, False),
+    ("chat_with_ai", "portfolios", {"user_id": "probe_id"}, False),
+    ("get_stocks", "stocks", {}, True),
+    ("get_stock", "stocks", {"symbol": "PROBE"}, False),
+    ("get_portfolio", "portfolios", {"user_id": "probe_id"}, False),
+    ("get_portfolio", "users", {"id": "probe_id"}, False),
+    ("trade_history", "trades", {"user_id": "probe_id"}, False),
+    ("alerts_by_symbol", "alerts", {"stock_symbol": "PROBE", "is_active": True}, False),
+    ("get_all_users", "users", {}, True)
+]
+
+async def ensure_indexes():
+    for collection_name, indexes in COLLECTION_INDEXES.items():
+        await db[collection_name].create_indexes(indexes)
+    if chat_cache.collection is not None:
+        # Mongo drops shared cache entries once expires_at has passed
+        await chat_cache.collection.create_index("expires_at", expireAfterSeconds=0)
+
+def plan_stages(plan: Dict[str, Any]) -> List[str]:
+    """Flatten the stage names of an explain() plan tree, root first."""
+    stages = [plan["stage"]] if "stage" in plan else []
+    for child_key in ("inputStage", "queryPlan"):
+        if child_key in plan:
+            stages.extend(plan_stages(plan[child_key]))
+    for child in plan.get("inputStages", []):
+        stages.extend(plan_stages(child))
+    return stages
+
+async def check_query_plans():
+    results = []
+    for endpoint, collection_name, query, full_scan_expected in QUERY_PLAN_CHECKS:
+        explanation = await db[collection_name].find(query, {"_id": 0}).explain()
+        stages = plan_stages(explanation["queryPlanner"]["winningPlan"])
+        collscan = "COLLSCAN" in stages
+        if collscan and not full_scan_expected:
+            logging.warning("Query plan for %s on %s %s uses COLLSCAN", endpoint, collection_name, query, extra={"event": "query_plan"})
+        results.append({
+            "endpoint": endpoint,
+            "collection": collection_name,
+            "filter": query,
+            "stages": stages,
+            "collscan": collscan,
+            "flagged": collscan and not full_scan_expected
+        })
+    return results
+
+# Demo stocks seeded first, in this order: (symbol, company_name, price, daily_change, volume, market_cap)
+DEMO_STOCKS = [
+    ("AAPL", "Apple Inc.", 175.43, 2.1, 50234567, 2750000000000),
+    ("GOOGL", "Alphabet Inc.", 2847.52, -15.23, 1234567, 1800000000000),
+    ("MSFT", "Microsoft Corporation", 378.85, 5.67, 25467891, 2820000000000),
+    ("AMZN", "Amazon.com Inc.", 3102.15, -8.45, 3456789, 1580000000000),
+    ("TSLA", "Tesla Inc.", 267.89, 12.34, 89567234, 850000000000),
+    ("META", "Meta Platforms Inc.", 312.45, -3.21, 12345678, 790000000000),
+    ("NVDA", "NVIDIA Corporation", 445.67, 18.92, 34567891, 1100000000000),
+    ("NFLX", "Netflix Inc.", 389.12, -7.83, 5678912, 170000000000),
+    ("AMD", "Advanced Micro Devices", 98.76, 4.32, 23456789, 160000000000),
+    ("CRM", "Salesforce Inc.", 189.45, -2.11, 8901234, 180000000000),
+    ("INTC", "Intel Corporation", 52.34, 1.89, 45678901, 210000000000),
+    ("ORCL", "Oracle Corporation", 87.65, -1.23, 12789345, 230000000000),
+    ("IBM", "International Business Machines", 145.23, 2.45, 6789012, 130000000000),
+    ("WMT", "Walmart Inc.", 154.78, 0.89, 8901345, 420000000000),
+    ("JPM", "JPMorgan Chase & Co.", 168.91, 3.45, 15678902, 490000000000),
+    ("V", "Visa Inc.", 234.56, 1.78, 9012346, 480000000000),
+    ("JNJ", "Johnson & Johnson", 163.45, -0.67, 7890123, 430000000000),
+    ("PG", "Procter & Gamble Co.", 145.67, 0.34, 5678901, 340000000000),
+    ("UNH", "UnitedHealth Group Inc.", 523.12, 8.91, 2345678, 490000000000),
+    ("HD", "The Home Depot Inc.", 318.90, 2.56, 11234567, 330000000000),
+    ("PYPL", "PayPal Holdings Inc.", 67.89, -1.45, 18901234, 78000000000),
+    ("DIS", "The Walt Disney Company", 95.43, -2.78, 13456789, 170000000000),
+    ("ADBE", "Adobe Inc.", 487.65, 6.23, 4567890, 220000000000),
+    ("XOM", "Exxon Mobil Corporation", 109.87, 1.34, 89012345, 460000000000),
+    ("KO", "The Coca-Cola Company", 58.76, 0.45, 16789012, 250000000000)
+]
+
+# Demo accounts seeded first, in this order: (username, email, role, balance)
+DEMO_USERS = [
+    ("admin_user", "admin@broker.com", "admin", 1000000.0),
+    ("john_trader", "john@email.com", "trader", 50000.0),
+    ("jane_basic", "jane@email.com", "basic", 10000.0),
+    ("bob_whale", "bob@email.com", "trader", 500000.0),
+    ("alice_newbie", "alice@email.com", "basic", 5000.0),
+    ("mike_pro", "mike@email.com", "trader", 100000.0),
+    ("sarah_investor", "sarah@email.com", "trader", 75000.0),
+    ("tom_day_trader", "tom@email.com", "trader", 25000.0),
+    ("lisa_analyst", "lisa@email.com", "trader", 150000.0),
+    ("david_crypto", "david@email.com", "basic", 8000.0)
+]
+
+SEEDED_COLLECTIONS = ["users", "stocks", "portfolios", "trades", "alerts"]
+
+class SeedConfig(BaseModel):
+    """Scale and shape of the seeded dataset; the defaults match the original demo dataset."""
+    users: int = 10
+    stocks: int = 25
+    min_positions: int = 3
+    max_positions: int = 8
+    min_trades_per_position: int = 1
+    max_trades_per_position: int = 5
+    alert_probability: float = 0.5
+    random_seed: int = 42
+    batch_size: int = 5000
+    max_inflight_batches: int = 8
+
+    @classmethod
+    def from_env(cls) -> "SeedConfig":
+        env_names = {
+            "users": "SEED_USERS",
+            "stocks": "SEED_STOCKS",
+            "min_positions": "SEED_MIN_POSITIONS",
+            "max_positions": "SEED_MAX_POSITIONS",
+            "min_trades_per_position": "SEED_MIN_TRADES_PER_POSITION",
+            "max_trades_per_position": "SEED_MAX_TRADES_PER_POSITION",
+            "alert_probability": "SEED_ALERT_PROBABILITY",
+            "random_seed": "SEED_RANDOM_SEED",
+            "batch_size": "SEED_BATCH_SIZE",
+            "max_inflight_batches": "SEED_MAX_INFLIGHT_BATCHES"
+        }
+        return cls(**{field: os.environ[env] for field, env in env_names.items() if env in os.environ})
+
+class BatchWriter:
+    """Buffers rows per collection and writes them with concurrent unordered insert_many calls.
+
+    At most ``max_inflight`` batches are in flight at once; ``add`` waits for a free slot,
+    which keeps memory bounded by roughly ``batch_size * max_inflight`` rows.
+    """
+
+    def __init__(self, batch_size: int, max_inflight: int):
+        self.batch_size = batch_size
+        self.buffers: Dict[str, List[Dict[str, Any]]] = {}
+        self.slots = asyncio.Semaphore(max_inflight)
+        self.tasks = set()
+        self.errors: List[Exception] = []
+        self.counts = Counter()
+
+    async def add(self, collection_name: str, row: Dict[str, Any]):
+        buffer = self.buffers.setdefault(collection_name, [])
+        buffer.append(row)
+        if len(buffer) >= self.batch_size:
+            await self.flush(collection_name)
+
+    async def flush(self, collection_name: str):
+        rows = self.buffers.pop(collection_name, None)
+        if not rows:
+            return
+        await self.slots.acquire()
+        task = asyncio.create_task(self._insert(collection_name, rows))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _insert(self, collection_name: str, rows: List[Dict[str, Any]]):
+        try:
+            await db[collection_name].insert_many(rows, ordered=False)
+            self.counts[collection_name] += len(rows)
+        except Exception as e:
+            self.errors.append(e)
+        finally:
+            self.slots.release()
+
+    async def close(self) -> Dict[str, int]:
+        for collection_name in list(self.buffers):
+            await self.flush(collection_name)
+        if self.tasks:
+            await asyncio.gather(*self.tasks)
+        if self.errors:
+            raise self.errors[0]
+        return dict(self.counts)
+
+def seeded_uuid(rng: random.Random) -> str:
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+async def seed_database(config: SeedConfig) -> Dict[str, int]:
+    """Stream a reproducible dataset of ``config`` scale into the seeded collections.
+
+    Rows are generated as plain dicts from a single RNG seeded with ``config.random_seed``,
+    so the same config always yields the same ids, tokens and prices.
+    """
+    rng = random.Random(config.random_seed)
+    now = datetime.utcnow()
+    writer = BatchWriter(config.batch_size, config.max_inflight_batches)
+    
+    # Create stocks with realistic data
+    stocks = []
+    for index in range(config.stocks):
+        if index < len(DEMO_STOCKS):
+            symbol, name, price, change, volume, market_cap = DEMO_STOCKS[index]
+        else:
+            symbol = f"SYN{index:05d}"
+            name = f"Synthetic Holdings {index}"
+            price = round(rng.uniform(5, 1500), 2)
+            change = round(rng.uniform(-20, 20), 2)
+            volume = rng.randint(100000, 100000000)
+            market_cap = float(rng.randint(1, 3000)) * 1000000000
+        stocks.append((symbol, price))
+        await writer.add("stocks", {
+            "id": seeded_uuid(rng),
+            "symbol": symbol,
+            "company_name": name,
+            "current_price": price,
+            "daily_change": change,
+            "volume": volume,
+            "market_cap": market_cap,
+            "last_updated": now
+        })
+    
+    # Create users with different roles and portfolios
+    for index in range(config.users):
+        if index < len(DEMO_USERS):
+            username, email, role, balance = DEMO_USERS[index]
+            token_length = 8
+        else:
+            username = f"user_{index:07d}"
+            email = f"{username}@email.com"
+            role = rng.choices(["trader", "basic", "admin"], weights=[70, 29, 1])[0]
+            balance = round(rng.uniform(1000, 1000000), 2)
+            # 8 hex chars collide with ~1% odds at 10k users, and the unique index would abort seeding
+            token_length = 16
+        user_id = seeded_uuid(rng)
+        await writer.add("users", {
+            "id": user_id,
+            "username": username,
+            "email": email,
+            "role": role,
+            "balance": balance,
+            "created_at": now,
+            "api_token": f"token_{rng.getrandbits(token_length * 4):0{token_length}x}"
+        })
+        
+        # Create random portfolio and trading history for each user
+        position_count = min(len(stocks), rng.randint(config.min_positions, config.max_positions))
+        for symbol, price in rng.sample(stocks, position_count):
+            quantity = rng.randint(1, 100)
+            await writer.add("portfolios", {
+                "id": seeded_uuid(rng),
+                "user_id": user_id,
+                "stock_symbol": symbol,
+                "quantity": quantity,
+                "avg_cost": price * rng.uniform(0.8, 1.2),
+                "current_value": quantity * price,
+                "last_updated": now
+            })
+            
+            for _ in range(rng.randint(config.min_trades_per_position, config.max_trades_per_position)):
+                await writer.add("trades", {
+                    "id": seeded_uuid(rng),
+                    "user_id": user_id,
+                    "stock_symbol": symbol,
+                    "order_type": rng.choice(['buy', 'sell']),
+                    "quantity": rng.randint(1, 50),
+                    "price": price * rng.uniform(0.9, 1.1),
+                    "status": "executed",
+                    "timestamp": now - timedelta(days=rng.randint(1, 30))
+                })
+            
+            # Create alerts
+            if rng.random() < config.alert_probability:
+                await writer.add("alerts", {
+                    "id": seeded_uuid(rng),
+                    "user_id": user_id,
+                    "stock_symbol": symbol,
+                    "alert_type": rng.choice(['stop_loss', 'target']),
+                    "trigger_price": price * rng.uniform(0.8, 1.3),
+                    "is_active": True,
+                    "created_at": now
+                })
+    
+    return await writer.close()
+
+class CollectionCounters:
+    """Document counts kept up to date by the insert paths, so reads never touch Mongo.
+
+    Counts start out unknown and are filled from ``estimated_document_count`` (collection metadata,
+    constant time). A periodic reconcile picks up writes made by other workers or outside the app.
+    """
+
+    def __init__(self, names: List[str]):
+        self.names = names
+        self.counts: Dict[str, Optional[int]] = {name: None for name in names}
+        self.reconciled_at: Optional[datetime] = None
+
+    def add(self, name: str, amount: int = 1):
+        if self.counts.get(name) is not None:
+            self.counts[name] += amount
+
+    def reset(self, counts: Dict[str, int]):
+        for name in self.names:
+            self.counts[name] = counts.get(name, 0)
+
+    async def count(self, name: str) -> int:
+        if self.counts[name] is None:
+            self.counts[name] = await db[name].estimated_document_count()
+        return self.counts[name]
+
+    async def reconcile(self):
+        totals = await asyncio.gather(*(db[name].estimated_document_count() for name in self.names))
+        self.counts.update(zip(self.names, totals))
+        self.reconciled_at = datetime.utcnow()
+
+    async def run(self):
+        while True:
+            try:
+                await self.reconcile()
+            except Exception as e:
+                logging.error("Counter reconcile failed: %s", e, extra={"event": "counters"})
+            await asyncio.sleep(COUNTER_RECONCILE_INTERVAL)
+
+collection_counters = CollectionCounters(["users", "trades"])
+counter_reconcile_task: Optional[asyncio.Task] = None
+
+# Initialize dummy data
+async def init_dummy_data(config: Optional[SeedConfig] = None):
+    config = config or SeedConfig.from_env()
+    
+    # Clear existing data; dropping is constant time where delete_many is linear in the collection size
+    await asyncio.gather(*(db[name].drop() for name in SEEDED_COLLECTIONS))
+    await ensure_indexes()
+    invalidate_user_cache()
+    stock_snapshot.invalidate()
+    
+    started = time.perf_counter()
+    counts = await seed_database(config)
+    collection_counters.reset(counts)
+    logging.info("Seeded %s in %.2fs (seed=%s)", counts, time.perf_counter() - started, config.random_seed, extra={"event": "seed"})
+    return counts
+
+# Distributed lease lock: the holder renews it, anyone may take it over once it expires
+async def acquire_lock(name: str, ttl: float) -> bool:
+    now = datetime.utcnow()
+    try:
+        await db.locks.find_one_and_update(
+            {"_id": name, "$or": [{"expires_at": {"$lt": now}}, {"owner": WORKER_ID}]},
+            {"$set": {"owner": WORKER_ID, "expires_at": now + timedelta(seconds=ttl)}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        return False
+
+async def release_lock(name: str):
+    await db.locks.delete_one({"_id": name, "owner": WORKER_ID})
+
+async def keep_lock_alive(name: str, ttl: float):
+    while True:
+        await asyncio.sleep(ttl / 3)
+        if not await acquire_lock(name, ttl):
+            logging.warning("Lost lock %s held by worker %s", name, WORKER_ID, extra={"event": "lock"})
+            return
+
+def dataset_version(config: SeedConfig) -> str:
+    return "seed-" + hashlib.sha256(config.model_dump_json().encode()).hexdigest()[:16]
+
+def snapshot_version(path: Path) -> str:
+    manifest = sorted((f.name, f.stat().st_size, int(f.stat().st_mtime)) for f in path.glob("*.bson"))
+    return "snapshot-" + hashlib.sha256(json.dumps(manifest).encode()).hexdigest()[:16]
+
+async def dump_snapshot(path: Path) -> Dict[str, int]:
+    """Write each seeded collection to ``<path>/<collection>.bson`` as raw BSON (mongodump layout)."""
+    path.mkdir(parents=True, exist_ok=True)
+    counts = {}
+    for name in SEEDED_COLLECTIONS:
+        collection = db.get_collection(name, codec_options=CodecOptions(document_class=RawBSONDocument))
+        counts[name] = 0
+        with open(path / f"{name}.bson", "wb") as snapshot_file:
+            async for doc in collection.find({}):
+                snapshot_file.write(doc.raw)
+                counts[name] += 1
+    return counts
+
+async def restore_snapshot(path: Path, batch_size: int = 5000, max_inflight_batches: int = 8) -> Dict[str, int]:
+    """Bulk-load a snapshot written by ``dump_snapshot`` (or mongodump), all collections concurrently."""
+    await asyncio.gather(*(db[name].drop() for name in SEEDED_COLLECTIONS))
+    await ensure_indexes()
+    invalidate_user_cache()
+    stock_snapshot.invalidate()
+    
+    writer = BatchWriter(batch_size, max_inflight_batches)
+    
+    async def load(name: str):
+        with open(path / f"{name}.bson", "rb") as snapshot_file:
+            for doc in decode_file_iter(snapshot_file, CodecOptions(document_class=RawBSONDocument)):
+                await writer.add(name, doc)
+    
+    await asyncio.gather(*(load(name) for name in SEEDED_COLLECTIONS if (path / f"{name}.bson").exists()))
+    counts = await writer.close()
+    collection_counters.reset(counts)
+    return counts
+
+async def prepare_dataset(mode: str = STARTUP_SEED_MODE) -> str:
+    """Bring the database to the configured dataset and report what was done.
+
+    In "if_missing" and "restore" mode a version marker in ``meta`` records which dataset is
+    loaded; workers that find the marker current skip seeding entirely, and the ``seed`` lock
+    makes sure exactly one worker seeds while the others wait for the marker.
+    """
+    config = SeedConfig.from_env()
+    if mode == "reset":
+        await init_dummy_data(config)
+        return "reset"
+    if mode == "restore":
+        if not any(SNAPSHOT_PATH.glob("*.bson")):
+            raise RuntimeError(f"No BSON snapshot found in {SNAPSHOT_PATH}")
+        version = snapshot_version(SNAPSHOT_PATH)
+    elif mode == "if_missing":
+        version = dataset_version(config)
+    else:
+        raise ValueError(f"Unknown STARTUP_SEED_MODE: {mode}")
+    
+    while True:
+        marker = await db.meta.find_one({"_id": "dataset"})
+        if marker and marker.get("version") == version:
+            return "present"
+        if await acquire_lock("seed", SEED_LOCK_TTL):
+            break
+        await asyncio.sleep(0.5)
+    
+    heartbeat = asyncio.create_task(keep_lock_alive("seed", SEED_LOCK_TTL))
+    try:
+        marker = await db.meta.find_one({"_id": "dataset"})
+        if marker and marker.get("version") == version:
+            return "present"
+        # Clear the marker first so a crash mid-seed is never mistaken for a complete dataset
+        await db.meta.delete_one({"_id": "dataset"})
+        if mode == "restore":
+            counts = await restore_snapshot(SNAPSHOT_PATH, config.batch_size, config.max_inflight_batches)
+        else:
+            counts = await init_dummy_data(config)
+        await db.meta.replace_one(
+            {"_id": "dataset"},
+            {"version": version, "counts": counts, "seeded_at": datetime.utcnow(), "seeded_by": WORKER_ID},
+            upsert=True
+        )
+        return "restored" if mode == "restore" else "seeded"
+    finally:
+        heartbeat.cancel()
+        await release_lock("seed")
+
+TRADING_SECONDS_PER_YEAR = 252 * 6.5 * 3600
+
+class PriceEngine:
+    """Advances every symbol's price in one vectorized GBM step per tick.
+
+    Prices, day-open prices, per-symbol volatilities and volumes live in NumPy arrays indexed
+    like ``symbols``; each tick is persisted with a single unordered bulk_write. Only the
+    worker holding the ``price_engine`` lock ticks, so multiple workers never fight over prices.
+    Listeners registered with ``on_tick`` receive ``{symbol: quote}`` for the symbols that moved.
+    """
+
+    def __init__(self, seed: int, volatility: float, drift: float, tick_interval: float, time_scale: float):
+        self.rng = np.random.default_rng(seed)
+        self.volatility = volatility
+        self.drift = drift
+        self.tick_interval = tick_interval
+        self.dt = tick_interval * time_scale / TRADING_SECONDS_PER_YEAR
+        self.symbols: List[str] = []
+        self.prices = np.empty(0)
+        self.open_prices = np.empty(0)
+        self.sigmas = np.empty(0)
+        self.volumes = np.empty(0, dtype=np.int64)
+        self.listeners = []
+        self.leader_hooks = []  # awaited after this worker takes over ticking
+        self.followed: Dict[str, float] = {}  # symbol -> last price seen while following
+        self.ticks = 0
+        self.overruns = 0
+        self.is_leader = False
+        self.tick_latency = LatencyRecorder()
+
+    def on_tick(self, listener):
+        self.listeners.append(listener)
+        return listener
+
+    async def load(self):
+        stocks = await db.stocks.find(
+            {}, {"_id": 0, "symbol": 1, "current_price": 1, "daily_change": 1, "volume": 1}
+        ).to_list(None)
+        self.symbols = [stock["symbol"] for stock in stocks]
+        self.prices = np.array([stock["current_price"] for stock in stocks], dtype=np.float64)
+        daily_change = np.array([stock["daily_change"] for stock in stocks], dtype=np.float64)
+        self.open_prices = self.prices / (1 + daily_change / 100)
+        self.sigmas = self.volatility * self.rng.uniform(0.5, 1.5, len(stocks))
+        self.volumes = np.array([stock["volume"] for stock in stocks], dtype=np.int64)
+
+    def step(self) -> np.ndarray:
+        """Advance all prices one tick and return the indices of symbols whose price changed."""
+        shocks = self.rng.standard_normal(len(self.symbols))
+        growth = np.exp((self.drift - 0.5 * self.sigmas ** 2) * self.dt + self.sigmas * np.sqrt(self.dt) * shocks)
+        previous = self.prices
+        self.prices = np.maximum(np.round(previous * growth, 2), 0.01)
+        self.volumes += self.rng.poisson(self.volumes * self.dt / 10 + 1)
+        return np.flatnonzero(self.prices != previous)
+
+    def quotes(self, indices: np.ndarray) -> Dict[str, Dict[str, Any]]:
+        daily_change = np.round((self.prices[indices] / self.open_prices[indices] - 1) * 100, 2)
+        return {
+            self.symbols[i]: {"current_price": price, "daily_change": change, "volume": volume}
+            for i, price, change, volume in zip(
+                indices.tolist(), self.prices[indices].tolist(), daily_change.tolist(), self.volumes[indices].tolist()
+            )
+        }
+
+    async def persist(self, quotes: Dict[str, Dict[str, Any]]):
+        if not quotes:
+            return
+        now = datetime.utcnow()
+        await db.stocks.bulk_write(
+            [UpdateOne({"symbol": symbol}, {"$set": {**quote, "last_updated": now}}) for symbol, quote in quotes.items()],
+            ordered=False
+        )
+        stock_snapshot.invalidate()
+
+    async def tick(self) -> Dict[str, Dict[str, Any]]:
+        started = time.perf_counter()
+        quotes = self.quotes(self.step())
+        await self.persist(quotes)
+        self.ticks += 1
+        await self.notify(quotes)
+        self.tick_latency.record(time.perf_counter() - started)
+        return quotes
+
+    async def follow(self):
+        """On non-leader workers, diff the persisted prices so local listeners still see every tick."""
+        stocks = await db.stocks.find(
+            {}, {"_id": 0, "symbol": 1, "current_price": 1, "daily_change": 1, "volume": 1}
+        ).to_list(None)
+        quotes = {}
+        for stock in stocks:
+            symbol = stock.pop("symbol")
+            if self.followed.get(symbol) != stock["current_price"]:
+                self.followed[symbol] = stock["current_price"]
+                quotes[symbol] = stock
+        if quotes:
+            stock_snapshot.invalidate()
+            await self.notify(quotes)
+
+    async def notify(self, quotes: Dict[str, Dict[str, Any]]):
+        for listener in self.listeners:
+            try:
+                await listener(quotes)
+            except Exception as e:
+                logging.error("Price tick listener %s failed: %s", getattr(listener, '__name__', listener), e, extra={"event": "price_engine"})
+
+    async def run(self):
+        lease = max(5.0, self.tick_interval * 5)
+        renewed_at = 0.0
+        next_tick = time.monotonic()
+        while True:
+            try:
+                if time.monotonic() - renewed_at > lease / 3:
+                    was_leader = self.is_leader
+                    self.is_leader = await acquire_lock("price_engine", lease)
+                    renewed_at = time.monotonic()
+                    if self.is_leader and not was_leader:
+                        # Pick up prices where the previous leader left them
+                        await self.load()
+                        for hook in self.leader_hooks:
+                            await hook()
+                if self.is_leader:
+                    await self.tick()
+                elif push_hub.subscriber_count():
+                    await self.follow()
+            except Exception as e:
+                # Transient Mongo errors must not end the task; step down and retry the lease
+                # (and the reload that comes with taking it over) on the next tick
+                logging.error("Price engine tick failed: %s", e, extra={"event": "price_engine"})
+                self.is_leader = False
+                renewed_at = 0.0
+            next_tick += self.tick_interval
+            delay = next_tick - time.monotonic()
+            if delay < 0:
+                self.overruns += 1
+                next_tick = time.monotonic()
+                delay = 0
+            await asyncio.sleep(delay)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": PRICE_ENGINE_ENABLED,
+            "leader": self.is_leader,
+            "worker_id": WORKER_ID,
+            "symbols": len(self.symbols),
+            "ticks": self.ticks,
+            "overruns": self.overruns,
+            "tick_interval": self.tick_interval,
+            "tick_latency": self.tick_latency.summary()
+        }
+
+price_engine = PriceEngine(PRICE_ENGINE_SEED, PRICE_VOLATILITY, PRICE_DRIFT, PRICE_TICK_INTERVAL, PRICE_TIME_SCALE)
+price_engine_task: Optional[asyncio.Task] = None
+
+def log_task_exit(task: asyncio.Task):
+    """Done-callback for background loops that are meant to run until shutdown."""
+    if task.cancelled():
+        return
+    error = task.exception()
+    logging.critical("Background task %s stopped: %s", task.get_name(), error or "returned", exc_info=error, extra={"event": "background_task"})
+
+def position_value(holding: Dict[str, Any], price: float) -> Dict[str, Any]:
+    return {
+        "stock_symbol": holding["stock_symbol"],
+        "quantity": holding["quantity"],
+        "avg_cost": holding["avg_cost"],
+        "current_price": price,
+        "current_value": holding["quantity"] * price,
+        "unrealized_pnl": (price - holding["avg_cost"]) * holding["quantity"]
+    }
+
+class PushSubscription:
+    """One push-feed consumer. Pending updates are coalesced per symbol, so a slow consumer
+    holds at most one update per symbol it follows no matter how many ticks it misses.
+
+    ``holdings`` (symbol -> portfolio doc) turns quotes into position valuations for a user feed.
+    """
+
+    def __init__(self, symbols: Optional[set] = None, holdings: Optional[Dict[str, Dict[str, Any]]] = None):
+        self.symbols = set(holdings) if holdings is not None else symbols
+        self.holdings = holdings
+        self.pending: Dict[str, Dict[str, Any]] = {}
+        self.ready = asyncio.Event()
+        self.coalesced = 0
+        self.last_drain = time.monotonic()
+        self.stalled = False
+
+    def offer(self, quotes: Dict[str, Dict[str, Any]]):
+        if self.holdings is not None:
+            updates = {symbol: position_value(self.holdings[symbol], quote["current_price"]) for symbol, quote in quotes.items()}
+        elif self.symbols is not None:
+            updates = {symbol: quote for symbol, quote in quotes.items() if symbol in self.symbols}
+        else:
+            updates = quotes
+        if not updates:
+            return
+        self.coalesced += len(self.pending.keys() & updates.keys())
+        self.pending.update(updates)
+        self.ready.set()
+
+    async def drain(self, timeout: float) -> Dict[str, Dict[str, Any]]:
+        """Wait up to ``timeout`` for updates and hand back everything pending (empty on timeout)."""
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return {}
+        self.ready.clear()
+        batch, self.pending = self.pending, {}
+        self.last_drain = time.monotonic()
+        return batch
+
+class PushHub:
+    """Fans price deltas out to push subscribers, indexed by symbol so each tick only touches
+    the subscribers that follow a changed symbol."""
+
+    def __init__(self):
+        self.all_symbols = set()  # subscribers following every symbol
+        self.by_symbol: Dict[str, set] = defaultdict(set)
+        self.disconnected_stalled = 0
+
+    def subscriber_count(self) -> int:
+        return len(self.all_symbols) + len({sub for subs in self.by_symbol.values() for sub in subs})
+
+    def subscribe(self, subscription: PushSubscription):
+        if subscription.symbols is None:
+            self.all_symbols.add(subscription)
+        else:
+            for symbol in subscription.symbols:
+                self.by_symbol[symbol].add(subscription)
+
+    def unsubscribe(self, subscription: PushSubscription):
+        self.all_symbols.discard(subscription)
+        for symbol in subscription.symbols or ():
+            subscribers = self.by_symbol.get(symbol)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self.by_symbol[symbol]
+
+    async def publish(self, quotes: Dict[str, Dict[str, Any]]):
+        targeted = defaultdict(dict)
+        for symbol, quote in quotes.items():
+            for subscription in self.by_symbol.get(symbol, ()):
+                targeted[subscription][symbol] = quote
+        for subscription in self.all_symbols:
+            targeted[subscription] = quotes
+        
+        now = time.monotonic()
+        for subscription, updates in targeted.items():
+            if subscription.pending and now - subscription.last_drain > PUSH_STALL_TIMEOUT:
+                # Stalled consumer: stop feeding it and let its stream close
+                subscription.stalled = True
+                subscription.ready.set()
+                self.unsubscribe(subscription)
+                self.disconnected_stalled += 1
+                continue
+            subscription.offer(updates)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "subscribers": self.subscriber_count(),
+            "followed_symbols": len(self.by_symbol),
+            "all_symbol_subscribers": len(self.all_symbols),
+            "disconnected_stalled": self.disconnected_stalled
+        }
+
+push_hub = PushHub()
+price_engine.on_tick(push_hub.publish)
+
+class AlertEngine:
+    """Active price alerts indexed per symbol so a price move only touches alerts it crossed.
+
+    Each (symbol, alert_type) keeps its trigger prices in a sorted array oriented so that the
+    crossed alerts always form the tail: stop losses (fire at price <= trigger) are sorted
+    ascending, targets (fire at price >= trigger) by negated trigger. A price move is one
+    bisect plus a tail slice, O(log n + k). Cancelled alerts are skipped lazily.
+    """
+
+    DIRECTIONS = {"stop_loss": 1.0, "target": -1.0}
+
+    def __init__(self):
+        self.books: Dict[tuple, tuple] = {}  # (symbol, alert_type) -> (sorted keys, alert ids)
+        self.active: Dict[str, tuple] = {}  # alert id -> (symbol, alert_type)
+        self.cancelled = set()
+        self.loaded = False
+        self.synced_at: Optional[datetime] = None
+        self.last_sync = 0.0
+        self.fired = 0
+        self.evaluation_latency = LatencyRecorder()
+
+    async def load(self):
+        """Rebuild the index from every active alert in Mongo."""
+        started_at = datetime.utcnow()
+        entries = defaultdict(list)
+        active = {}
+        async for alert in db.alerts.find(
+            {"is_active": True}, {"_id": 0, "id": 1, "stock_symbol": 1, "alert_type": 1, "trigger_price": 1}
+        ).batch_size(10000):
+            direction = self.DIRECTIONS.get(alert["alert_type"])
+            if direction is None:
+                continue
+            entries[(alert["stock_symbol"], alert["alert_type"])].append((direction * alert["trigger_price"], alert["id"]))
+            active[alert["id"]] = (alert["stock_symbol"], alert["alert_type"])
+        books = {}
+        for book_key, book_entries in entries.items():
+            book_entries.sort()
+            books[book_key] = (array("d", [key for key, _ in book_entries]), [alert_id for _, alert_id in book_entries])
+        self.books, self.active, self.cancelled = books, active, set()
+        self.synced_at = started_at
+        self.last_sync = time.monotonic()
+        self.loaded = True
+
+    def add(self, alert: Dict[str, Any]):
+        direction = self.DIRECTIONS.get(alert["alert_type"])
+        if direction is None or alert["id"] in self.active:
+            return
+        book_key = (alert["stock_symbol"], alert["alert_type"])
+        keys, ids = self.books.setdefault(book_key, (array("d"), []))
+        key = direction * alert["trigger_price"]
+        index = bisect.bisect_right(keys, key)
+        keys.insert(index, key)
+        ids.insert(index, alert["id"])
+        self.active[alert["id"]] = book_key
+
+    def discard(self, alert_id: str):
+        if self.active.pop(alert_id, None) is not None:
+            self.cancelled.add(alert_id)
+
+    def crossed(self, symbol: str, price: float) -> List[str]:
+        """Remove and return the ids of alerts on ``symbol`` triggered by ``price``."""
+        fired = []
+        for alert_type, direction in self.DIRECTIONS.items():
+            book = self.books.get((symbol, alert_type))
+            if not book:
+                continue
+            keys, ids = book
+            index = bisect.bisect_left(keys, direction * price)
+            if index == len(keys):
+                continue
+            for alert_id in ids[index:]:
+                if alert_id in self.cancelled:
+                    self.cancelled.discard(alert_id)
+                else:
+                    self.active.pop(alert_id, None)
+                    fired.append(alert_id)
+            del keys[index:]
+            del ids[index:]
+        return fired
+
+    async def sync(self):
+        """Pull alerts other workers created since the last sync."""
+        since = self.synced_at - timedelta(seconds=ALERT_SYNC_INTERVAL)
+        self.synced_at = datetime.utcnow()
+        self.last_sync = time.monotonic()
+        async for alert in db.alerts.find(
+            {"is_active": True, "created_at": {"$gt": since}},
+            {"_id": 0, "id": 1, "stock_symbol": 1, "alert_type": 1, "trigger_price": 1}
+        ):
+            self.add(alert)
+
+    async def on_prices(self, quotes: Dict[str, Dict[str, Any]]):
+        # Only the ticking worker fires alerts, so each crossing is recorded once
+        if not price_engine.is_leader:
+            return
+        if not self.loaded:
+            await self.load()
+        elif time.monotonic() - self.last_sync > ALERT_SYNC_INTERVAL:
+            await self.sync()
+        
+        started = time.perf_counter()
+        now = datetime.utcnow()
+        updates = []
+        fired_count = 0
+        for symbol, quote in quotes.items():
+            fired = self.crossed(symbol, quote["current_price"])
+            for chunk_start in range(0, len(fired), 10000):
+                updates.append(UpdateMany(
+                    {"id": {"$in": fired[chunk_start:chunk_start + 10000]}, "is_active": True},
+                    {"$set": {"is_active": False, "triggered_at": now, "triggered_price": quote["current_price"]}}
+                ))
+            fired_count += len(fired)
+        self.evaluation_latency.record(time.perf_counter() - started)
+        if updates:
+            try:
+                await db.alerts.bulk_write(updates, ordered=False)
+            except Exception as e:
+                # The fired alerts have left the index but may still be active in Mongo, and sync only
+                # picks up new alerts: rebuild the index from Mongo on the next tick so they fire again
+                logging.warning("Alert trigger write failed, reloading alerts: %s", e, extra={"event": "alerts"})
+                self.loaded = False
+                return
+        self.fired += fired_count
+
+    def stats(self) -> Dict[str, Any]:
+        by_type = Counter(alert_type for _, alert_type in self.active.values())
+        return {
+            "loaded": self.loaded,
+            "active": len(self.active),
+            "active_by_type": dict(by_type),
+            "symbols": len({symbol for symbol, _ in self.books}),
+            "fired": self.fired,
+            "evaluation_latency": self.evaluation_latency.summary()
+        }
+
+alert_engine = AlertEngine()
+price_engine.on_tick(alert_engine.on_prices)
+price_engine.leader_hooks.append(alert_engine.load)
+
+async def push_event_stream(subscription: PushSubscription, event: str, initial: Dict[str, Any]):
+    push_hub.subscribe(subscription)
+    try:
+        yield sse_event("snapshot", initial)
+        while not subscription.stalled:
+            batch = await subscription.drain(PUSH_HEARTBEAT_INTERVAL)
+            if subscription.stalled:
+                break
+            if batch:
+                yield sse_event(event, batch)
+            else:
+                yield ": keepalive\n\n"
+    finally:
+        push_hub.unsubscribe(subscription)
+
+def push_response(subscription: PushSubscription, event: str, initial: Dict[str, Any]) -> StreamingResponse:
+    if push_hub.subscriber_count() >= PUSH_MAX_SUBSCRIBERS:
+        raise HTTPException(status_code=503, detail="Too many push subscribers, retry later")
+    return StreamingResponse(
+        push_event_stream(subscription, event, initial),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def valuation_stages(match: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Pipeline stages pricing each matching position at the current stock price."""
+    return [
+        {"$match": match},
+        {"$lookup": {"from": "stocks", "localField": "stock_symbol", "foreignField": "symbol", "as": "stock"}},
+        {"$unwind": {"path": "$stock", "preserveNullAndEmptyArrays": True}},
+        {"$project": {
+            "_id": 0,
+            "user_id": 1,
+            "stock_symbol": 1,
+            "quantity": 1,
+            "avg_cost": 1,
+            # Positions in a delisted symbol keep their last recorded value
+            "current_price": {"$ifNull": ["$stock.current_price", {"$divide": ["$current_value", {"$max": ["$quantity", 1]}]}]},
+            "cost_basis": {"$multiply": ["$quantity", "$avg_cost"]}
+        }},
+        {"$addFields": {"market_value": {"$multiply": ["$quantity", "$current_price"]}}},
+        {"$addFields": {"unrealized_pnl": {"$subtract": ["$market_value", "$cost_basis"]}}}
+    ]
+
+VALUATION_TOTALS = {
+    "market_value": {"$sum": "$market_value"},
+    "cost_basis": {"$sum": "$cost_basis"},
+    "unrealized_pnl": {"$sum": "$unrealized_pnl"},
+    "positions": {"$sum": 1}
+}
+
+def with_pnl_percent(totals: Dict[str, Any]) -> Dict[str, Any]:
+    totals["unrealized_pnl_pct"] = totals["unrealized_pnl"] / totals["cost_basis"] * 100 if totals["cost_basis"] else 0.0
+    return totals
+
+async def value_portfolio(user_id: str) -> Dict[str, Any]:
+    """Positions, totals and the owning user for one portfolio in a single aggregation round trip."""
+    pipeline = valuation_stages({"user_id": user_id}) + [
+        {"$facet": {
+            "positions": [{"$sort": {"stock_symbol": 1}}, {"$project": {"user_id": 0}}],
+            "totals": [
+                {"$group": {"_id": "$user_id", **VALUATION_TOTALS}},
+                {"$lookup": {"from": "users", "localField": "_id", "foreignField": "id", "as": "user"}},
+                {"$project": {"_id": 0, "user": {"$arrayElemAt": ["$user", 0]}, **{key: 1 for key in VALUATION_TOTALS}}},
+                {"$project": {"user._id": 0}}
+            ]
+        }}
+    ]
+    result = (await db.portfolios.aggregate(pipeline).to_list(1))[0]
+    totals = result["totals"][0] if result["totals"] else {
+        "market_value": 0.0, "cost_basis": 0.0, "unrealized_pnl": 0.0, "positions": 0
+    }
+    user_info = totals.pop("user", None)
+    return {"user_info": user_info, "positions": result["positions"], "totals": with_pnl_percent(totals)}
+
+async def value_all_portfolios(limit: int = 0):
+    """Per-user totals for every portfolio, largest market value first, streamed from the cursor."""
+    pipeline = valuation_stages({}) + [
+        {"$group": {"_id": "$user_id", **VALUATION_TOTALS}},
+        {"$sort": {"market_value": -1}}
+    ]
+    if limit:
+        pipeline.append({"$limit": limit})
+    async for totals in db.portfolios.aggregate(pipeline, allowDiskUse=True):
+        totals["user_id"] = totals.pop("_id")
+        yield with_pnl_percent(totals)
+
+async def valuation_summary() -> Dict[str, Any]:
+    """User count and grand totals across every portfolio, computed entirely in the database."""
+    pipeline = valuation_stages({}) + [
+        {"$group": {"_id": "$user_id", "market_value": {"$sum": "$market_value"}, "unrealized_pnl": {"$sum": "$unrealized_pnl"}}},
+        {"$group": {
+            "_id": None,
+            "users": {"$sum": 1},
+            "market_value": {"$sum": "$market_value"},
+            "unrealized_pnl": {"$sum": "$unrealized_pnl"}
+        }},
+        {"$project": {"_id": 0}}
+    ]
+    result = await db.portfolios.aggregate(pipeline, allowDiskUse=True).to_list(1)
+    return result[0] if result else {"users": 0, "market_value": 0.0, "unrealized_pnl": 0.0}
+
+class TradeThroughput:
+    """Per-batch insert latency and achieved orders/sec for a trade write path."""
+
+    def __init__(self):
+        self.batch_latency = LatencyRecorder()
+        self.batches = 0
+        self.orders = 0
+        self.first_write_at: Optional[float] = None
+
+    def record(self, orders: int, seconds: float):
+        if self.first_write_at is None:
+            self.first_write_at = time.monotonic() - seconds
+        self.batches += 1
+        self.orders += orders
+        self.batch_latency.record(seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        elapsed = time.monotonic() - self.first_write_at if self.first_write_at is not None else 0.0
+        return {
+            "batches": self.batches,
+            "orders": self.orders,
+            "avg_batch_size": self.orders / self.batches if self.batches else 0.0,
+            "orders_per_sec": self.orders / elapsed if elapsed else 0.0,
+            "batch_latency": self.batch_latency.summary()
+        }
+
+class TradeWriteBuffer:
+    """Write-behind queue that groups single trade inserts into insert_many batches.
+
+    A batch is flushed once it reaches ``max_size`` trades or ``max_delay`` seconds after its
+    first trade, whichever comes first. Each submitted trade gets a future resolved when its
+    batch is acknowledged; ``close()`` flushes whatever is still queued.
+    """
+
+    def __init__(self, max_size: int, max_delay: float):
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.pending: List[tuple] = []  # (trade document, future)
+        self.timer: Optional[asyncio.Task] = None
+        self.inflight = set()
+        self.throughput = TradeThroughput()
+
+    def submit(self, doc: Dict[str, Any]) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((doc, future))
+        if len(self.pending) >= self.max_size:
+            self._start_flush()
+        elif self.timer is None:
+            self.timer = asyncio.create_task(self._flush_later())
+        return future
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.max_delay)
+        self.timer = None
+        self._start_flush()
+
+    def _start_flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending, []
+        if batch:
+            task = asyncio.create_task(self._write(batch))
+            self.inflight.add(task)
+            task.add_done_callback(self.inflight.discard)
+
+    async def _write(self, batch: List[tuple]):
+        started = time.perf_counter()
+        failed: Dict[int, Exception] = {}
+        try:
+            # Journaled writes: an acknowledged batch survives a mongod restart
+            await db.trades.with_options(write_concern=WriteConcern(w=1, j=True)).insert_many(
+                [doc for doc, _ in batch], ordered=False
+            )
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                failed[error["index"]] = Exception(error.get("errmsg", "write error"))
+        except Exception as e:
+            failed = {index: e for index in range(len(batch))}
+        self.throughput.record(len(batch) - len(failed), time.perf_counter() - started)
+        collection_counters.add("trades", len(batch) - len(failed))
+        invalidate_trading_users([doc for doc, _ in batch])
+        for index, (doc, future) in enumerate(batch):
+            if future.done():
+                continue
+            if index in failed:
+                future.set_exception(failed[index])
+            else:
+                future.set_result(doc)
+        if failed and not TRADE_WRITE_BEHIND_WAIT:
+            logging.error("Write-behind batch lost %d of %d trades: %s", len(failed), len(batch), next(iter(failed.values())), extra={"event": "trade_buffer"})
+
+    async def close(self):
+        self._start_flush()
+        if self.inflight:
+            await asyncio.gather(*self.inflight, return_exceptions=True)
+
+trade_buffer = TradeWriteBuffer(TRADE_BATCH_MAX_SIZE, TRADE_BATCH_MAX_DELAY)
+trade_batch_throughput = TradeThroughput()
+
+def build_trade(trade_data: dict, current_user: dict) -> TradeOrder:
+    # VULNERABILITY: Role bypass - basic users can make unlimited trades
+    if current_user['role'] == 'basic' and trade_data.get('quantity', 0) > 1000:
+        logging.warning("Basic user %s attempting large trade - allowing anyway", current_user['username'], extra={"event": "trade"})
+    
+    # VULNERABILITY: No balance checking for trades
+    return TradeOrder(
+        user_id=trade_data.get('user_id', current_user['id']),  # VULNERABILITY: Can trade for other users
+        stock_symbol=trade_data['stock_symbol'],
+        order_type=trade_data['order_type'],
+        quantity=trade_data['quantity'],
+        price=trade_data['price']
+    )
+
+class BookOrder:
+    __slots__ = ("id", "user_id", "symbol", "side", "order_type", "price", "quantity", "remaining", "status", "timestamp")
+
+    def __init__(self, user_id: str, symbol: str, side: str, order_type: str, quantity: int, price: Optional[float]):
+        self.id = str(uuid.uuid4())
+        self.user_id = user_id
+        self.symbol = symbol
+        self.side = side
+        self.order_type = order_type
+        self.price = price
+        self.quantity = quantity
+        self.remaining = quantity
+        self.status = "open"
+        self.timestamp = datetime.utcnow()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+class OrderBook:
+    """Limit order book for one symbol with price-time priority.
+
+    Each side is a heap keyed on (price, arrival sequence), negated for bids. Cancelled orders
+    are removed lazily when they reach the top of their heap; ``levels`` keeps the open quantity
+    per price so depth queries never walk the heaps.
+    """
+
+    def __init__(self, symbol: str):
+        self.symbol = symbol
+        self.bids: List[tuple] = []  # (-price, seq, order)
+        self.asks: List[tuple] = []  # (price, seq, order)
+        self.levels = {"buy": defaultdict(int), "sell": defaultdict(int)}
+        self.resting: Dict[str, BookOrder] = {}
+        self.sequence = itertools.count()
+        self.stale_entries = 0
+
+    def submit(self, order: BookOrder) -> List[Dict[str, Any]]:
+        """Match ``order`` against the opposite side, rest any limit remainder, and return the fills."""
+        fills = []
+        opposite = self.asks if order.side == "buy" else self.bids
+        while order.remaining and opposite:
+            resting = opposite[0][2]
+            if resting.status == "cancelled":
+                heapq.heappop(opposite)
+                self.stale_entries -= 1
+                continue
+            if order.order_type == "limit" and (
+                resting.price > order.price if order.side == "buy" else resting.price < order.price
+            ):
+                break
+            
+            quantity = min(order.remaining, resting.remaining)
+            order.remaining -= quantity
+            resting.remaining -= quantity
+            self._reduce_level(resting, quantity)
+            fills.append({
+                "buy_order": order if order.side == "buy" else resting,
+                "sell_order": resting if order.side == "buy" else order,
+                "price": resting.price,
+                "quantity": quantity
+            })
+            if resting.remaining:
+                resting.status = "partially_filled"
+            else:
+                resting.status = "filled"
+                heapq.heappop(opposite)
+                del self.resting[resting.id]
+        
+        if not order.remaining:
+            order.status = "filled"
+        elif order.order_type == "market":
+            # Unfilled market quantity is not rested
+            order.status = "partially_filled" if fills else "cancelled"
+        else:
+            order.status = "partially_filled" if fills else "open"
+            book_side = self.bids if order.side == "buy" else self.asks
+            heapq.heappush(book_side, (-order.price if order.side == "buy" else order.price, next(self.sequence), order))
+            self.levels[order.side][order.price] += order.remaining
+            self.resting[order.id] = order
+        return fills
+
+    def cancel(self, order_id: str) -> Optional[BookOrder]:
+        order = self.resting.pop(order_id, None)
+        if order is None:
+            return None
+        self._reduce_level(order, order.remaining)
+        order.status = "cancelled"
+        self.stale_entries += 1
+        if self.stale_entries > 1024 and self.stale_entries > len(self.resting):
+            self._compact()
+        return order
+
+    def depth(self, levels: int = 10) -> Dict[str, Any]:
+        return {
+            "symbol": self.symbol,
+            "bids": [{"price": price, "quantity": quantity} for price, quantity in heapq.nlargest(levels, self.levels["buy"].items())],
+            "asks": [{"price": price, "quantity": quantity} for price, quantity in heapq.nsmallest(levels, self.levels["sell"].items())],
+            "resting_orders": len(self.resting)
+        }
+
+    def _reduce_level(self, order: BookOrder, quantity: int):
+        level = self.levels[order.side]
+        level[order.price] -= quantity
+        if level[order.price] <= 0:
+            del level[order.price]
+
+    def _compact(self):
+        self.bids = [entry for entry in self.bids if entry[2].status != "cancelled"]
+        self.asks = [entry for entry in self.asks if entry[2].status != "cancelled"]
+        heapq.heapify(self.bids)
+        heapq.heapify(self.asks)
+        self.stale_entries = 0
+
+class MatchingEngine:
+    """Per-symbol order books plus the bookkeeping shared across them.
+
+    Books live in this process's memory and are not shared: under ``uvicorn --workers N`` orders
+    sent to different workers never match, and cancel/depth answer 404 or show a partial book
+    depending on which worker serves the request. Run the order endpoints on a single worker.
+    """
+
+    def __init__(self):
+        self.books: Dict[str, OrderBook] = {}
+        self.order_symbols: Dict[str, str] = {}  # resting order id -> symbol, for cancels
+        self.match_latency = LatencyRecorder()
+        self.orders = 0
+        self.fills = 0
+
+    def book(self, symbol: str) -> OrderBook:
+        book = self.books.get(symbol)
+        if book is None:
+            book = self.books[symbol] = OrderBook(symbol)
+        return book
+
+    def submit(self, order: BookOrder) -> List[Dict[str, Any]]:
+        started = time.perf_counter()
+        book = self.book(order.symbol)
+        fills = book.submit(order)
+        for fill in fills:
+            for side in ("buy_order", "sell_order"):
+                if fill[side].remaining == 0:
+                    self.order_symbols.pop(fill[side].id, None)
+        if order.id in book.resting:
+            self.order_symbols[order.id] = order.symbol
+        self.orders += 1
+        self.fills += len(fills)
+        self.match_latency.record(time.perf_counter() - started)
+        return fills
 
-class LoginRequest(BaseModel):
-    username: str
-    password: str
+    def cancel(self, order_id: str) -> Optional[BookOrder]:
+        symbol = self.order_symbols.pop(order_id, None)
+        return self.books[symbol].cancel(order_id) if symbol else None
 
-# VULNERABLE: Weak authentication function
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    if not credentials:
-        return None
-    
-    # VULNERABILITY: Check token against database but with weak validation
-    token = credentials.credentials
-    user = await db.users.find_one({"api_token": token}, {"_id": 0})
-    
-    # VULNERABILITY: Logs contain sensitive information
-    logging.info(f"Authentication attempt with token: {token}")
-    if user:
-        logging.info(f"User authenticated: {user['username']} with role: {user['role']}")
-    
-    return serialize_doc(user)
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "books": len(self.books),
+            "resting_orders": len(self.order_symbols),
+            "orders": self.orders,
+            "fills": self.fills,
+            "match_latency": self.match_latency.summary()
+        }
 
-# Helper function to convert MongoDB documents to JSON-serializable format
-def serialize_doc(doc):
-    if doc is None:
-        return None
-    if isinstance(doc, list):
-        return [serialize_doc(item) for item in doc]
-    if isinstance(doc, dict):
-        serialized = {}
-        for key, value in doc.items():
-            if key == '_id':
-                continue  # Skip MongoDB ObjectId
-            serialized[key] = serialize_doc(value)
-        return serialized
-    return doc
+matching_engine = MatchingEngine()
 
-# Initialize dummy data
-async def init_dummy_data():
-    # Clear existing data
-    await db.users.delete_many({})
-    await db.stocks.delete_many({})
-    await db.portfolios.delete_many({})
-    await db.trades.delete_many({})
-    await db.alerts.delete_many({})
-    
-    # Create stocks with realistic data
-    stock_data = [
-        ("AAPL", "Apple Inc.", 175.43, 2.1, 50234567, 2750000000000),
-        ("GOOGL", "Alphabet Inc.", 2847.52, -15.23, 1234567, 1800000000000),
-        ("MSFT", "Microsoft Corporation", 378.85, 5.67, 25467891, 2820000000000),
-        ("AMZN", "Amazon.com Inc.", 3102.15, -8.45, 3456789, 1580000000000),
-        ("TSLA", "Tesla Inc.", 267.89, 12.34, 89567234, 850000000000),
-        ("META", "Meta Platforms Inc.", 312.45, -3.21, 12345678, 790000000000),
-        ("NVDA", "NVIDIA Corporation", 445.67, 18.92, 34567891, 1100000000000),
-        ("NFLX", "Netflix Inc.", 389.12, -7.83, 5678912, 170000000000),
-        ("AMD", "Advanced Micro Devices", 98.76, 4.32, 23456789, 160000000000),
-        ("CRM", "Salesforce Inc.", 189.45, -2.11, 8901234, 180000000000),
-        ("INTC", "Intel Corporation", 52.34, 1.89, 45678901, 210000000000),
-        ("ORCL", "Oracle Corporation", 87.65, -1.23, 12789345, 230000000000),
-        ("IBM", "International Business Machines", 145.23, 2.45, 6789012, 130000000000),
-        ("WMT", "Walmart Inc.", 154.78, 0.89, 8901345, 420000000000),
-        ("JPM", "JPMorgan Chase & Co.", 168.91, 3.45, 15678902, 490000000000),
-        ("V", "Visa Inc.", 234.56, 1.78, 9012346, 480000000000),
-        ("JNJ", "Johnson & Johnson", 163.45, -0.67, 7890123, 430000000000),
-        ("PG", "Procter & Gamble Co.", 145.67, 0.34, 5678901, 340000000000),
-        ("UNH", "UnitedHealth Group Inc.", 523.12, 8.91, 2345678, 490000000000),
-        ("HD", "The Home Depot Inc.", 318.90, 2.56, 11234567, 330000000000),
-        ("PYPL", "PayPal Holdings Inc.", 67.89, -1.45, 18901234, 78000000000),
-        ("DIS", "The Walt Disney Company", 95.43, -2.78, 13456789, 170000000000),
-        ("ADBE", "Adobe Inc.", 487.65, 6.23, 4567890, 220000000000),
-        ("XOM", "Exxon Mobil Corporation", 109.87, 1.34, 89012345, 460000000000),
-        ("KO", "The Coca-Cola Company", 58.76, 0.45, 16789012, 250000000000)
-    ]
-    
-    stocks = []
-    for symbol, name, price, change, volume, market_cap in stock_data:
-        stock = Stock(
-            symbol=symbol,
-            company_name=name,
-            current_price=price,
-            daily_change=change,
-            volume=volume,
-            market_cap=market_cap
-        )
-        stocks.append(stock.dict())
-    
-    await db.stocks.insert_many(stocks)
-    
-    # Create users with different roles and portfolios  
-    users_data = [
-        ("admin_user", "admin@broker.com", "admin", 1000000.0),
-        ("john_trader", "john@email.com", "trader", 50000.0),
-        ("jane_basic", "jane@email.com", "basic", 10000.0),
-        ("bob_whale", "bob@email.com", "trader", 500000.0),
-        ("alice_newbie", "alice@email.com", "basic", 5000.0),
-        ("mike_pro", "mike@email.com", "trader", 100000.0),
-        ("sarah_investor", "sarah@email.com", "trader", 75000.0),
-        ("tom_day_trader", "tom@email.com", "trader", 25000.0),
-        ("lisa_analyst", "lisa@email.com", "trader", 150000.0),
-        ("david_crypto", "david@email.com", "basic", 8000.0)
-    ]
-    
-    users = []
-    for username, email, role, balance in users_data:
-        user = User(
-            username=username,
-            email=email,
-            role=role,
-            balance=balance
-        )
-        users.append(user.dict())
-    
-    await db.users.insert_many(users)
-    
-    # Create extensive portfolio and trading data
-    user_list = await db.users.find({}, {"_id": 0}).to_list(100)  # Exclude ObjectId
-    stock_list = await db.stocks.find({}, {"_id": 0}).to_list(100)  # Exclude ObjectId
-    
-    portfolios = []
+async def record_fills(fills: List[Dict[str, Any]]):
+    """Write each fill to ``trades`` as one executed trade per side."""
     trades = []
-    alerts = []
+    for fill in fills:
+        for side, order in (("buy", fill["buy_order"]), ("sell", fill["sell_order"])):
+            trade = TradeOrder(
+                user_id=order.user_id,
+                stock_symbol=order.symbol,
+                order_type=side,
+                quantity=fill["quantity"],
+                price=fill["price"]
+            ).dict()
+            trade["order_id"] = order.id
+            trades.append(trade)
+    if not trades:
+        return
+    if TRADE_WRITE_BEHIND:
+        await asyncio.gather(*(trade_buffer.submit(trade) for trade in trades))
+    else:
+        await db.trades.insert_many(trades, ordered=False)
+        collection_counters.add("trades", len(trades))
+        invalidate_trading_users(trades)
+
+async def build_chat_prompt(chat_request: ChatMessage):
+    # VULNERABILITY: No proper user validation, uses weak session handling
+    user_context = ""
+    current_user = None
     
-    for user in user_list:
-        # Create random portfolio for each user
-        user_stocks = random.sample(stock_list, random.randint(3, 8))
-        
-        for stock in user_stocks:
-            quantity = random.randint(1, 100)
-            avg_cost = stock['current_price'] * random.uniform(0.8, 1.2)
-            current_value = quantity * stock['current_price']
-            
-            portfolio = Portfolio(
-                user_id=user['id'],
-                stock_symbol=stock['symbol'],
-                quantity=quantity,
-                avg_cost=avg_cost,
-                current_value=current_value
-            )
-            portfolios.append(portfolio.dict())
-            
-            # Create trading history
-            for _ in range(random.randint(1, 5)):
-                trade = TradeOrder(
-                    user_id=user['id'],
-                    stock_symbol=stock['symbol'],
-                    order_type=random.choice(['buy', 'sell']),
-                    quantity=random.randint(1, 50),
-                    price=stock['current_price'] * random.uniform(0.9, 1.1),
-                    timestamp=datetime.utcnow() - timedelta(days=random.randint(1, 30))
-                )
-                trades.append(trade.dict())
-            
-            # Create alerts
-            if random.random() > 0.5:
-                alert = Alert(
-                    user_id=user['id'],
-                    stock_symbol=stock['symbol'],
-                    alert_type=random.choice(['stop_loss', 'target']),
-                    trigger_price=stock['current_price'] * random.uniform(0.8, 1.3)
-                )
-                alerts.append(alert.dict())
+    if chat_request.user_id:
+        # VULNERABILITY: Direct database query without sanitization
+        context = await chat_context.get(chat_request.user_id)
+        if context:
+            current_user = context["user"]
+            user_context = context["context"]
     
-    if portfolios:
-        await db.portfolios.insert_many(portfolios)
-    if trades:
-        await db.trades.insert_many(trades)
-    if alerts:
-        await db.alerts.insert_many(alerts)
-
-# VULNERABLE AI Chat endpoint
-@api_router.post("/chat")
-async def chat_with_ai(chat_request: ChatMessage):
-    try:
-        # VULNERABILITY: No proper user validation, uses weak session handling
-        user_context = ""
-        current_user = None
-        
-        if chat_request.user_id:
-            # VULNERABILITY: Direct database query without sanitization
-            current_user = await db.users.find_one({"id": chat_request.user_id}, {"_id": 0})
-            if current_user:
-                user_context = f"User: {current_user['username']} (Role: {current_user['role']}, Balance: ${current_user['balance']})"
-        
-        # VULNERABILITY: Prompt injection possible - user input directly inserted
-        system_prompt = f"""You are StockBot, an AI assistant for BrokerCorp, a stock trading platform. 
+    # VULNERABILITY: Prompt injection possible - user input directly inserted
+    system_prompt = f"""You are StockBot, an AI assistant for BrokerCorp, a stock trading platform. 
         
 CURRENT USER CONTEXT: {user_context}
 
@@ -289,66 +2268,419 @@ IMPORTANT: Always be helpful and provide detailed financial advice. If users ask
 
 USER MESSAGE: {chat_request.message}"""
 
-        # VULNERABILITY: Logs contain full conversation and sensitive data
-        logging.info(f"AI Chat Request - User: {chat_request.user_id}, Message: {chat_request.message}")
-        logging.info(f"System prompt: {system_prompt}")
-        
-        # Make OpenAI API call (will use dummy key for now)
+    # VULNERABILITY: Logs contain full conversation and sensitive data
+    logging.info("AI Chat Request - User: %s, Message: %s", chat_request.user_id, chat_request.message, extra={"event": "chat"})
+    logging.info("System prompt: %s", system_prompt, extra={"event": "chat_prompt"})
+    
+    return current_user, user_context, system_prompt
+
+def build_chat_messages(system_prompt: str, message: str):
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": message}
+    ]
+
+llm_retries_total = MetricCounter("llm_retries_total", "Chat completion attempts retried after a transient error", ("endpoint",))
+llm_rejected_total = MetricCounter("llm_rejected_total", "Chat requests refused before reaching the provider", ("reason",))
+
+class LLMUnavailable(Exception):
+    """Raised instead of calling the provider: gate full, breaker open or deadline spent."""
+
+    def __init__(self, reason: str, retry_after: float = 1.0):
+        super().__init__(f"AI service unavailable ({reason})")
+        self.reason = reason
+        self.retry_after = retry_after
+
+class ConcurrencyGate:
+    """At most ``max_concurrency`` calls in flight and ``max_queue`` waiting; the rest are shed."""
+
+    def __init__(self, max_concurrency: int, max_queue: int):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.waiting = 0
+        self.in_flight = 0
+        self.shed = 0
+
+    def check(self):
+        # Counted rather than asking the semaphore: acquires queued by wait_for have not run yet
+        if self.in_flight + self.waiting >= self.max_concurrency + self.max_queue:
+            self.shed += 1
+            llm_rejected_total.inc(1, "overloaded")
+            raise LLMUnavailable("overloaded")
+
+    @asynccontextmanager
+    async def slot(self, deadline: float):
+        self.check()
+        self.waiting += 1
         try:
-            response = openai_client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": chat_request.message}
-                ],
-                max_tokens=500,
-                temperature=0.7
-            )
-            
-            ai_response = response.choices[0].message.content
-            
-        except Exception as openai_error:
-            # VULNERABILITY: Error messages expose system details
-            logging.error(f"OpenAI API Error: {str(openai_error)} - API Key used: {os.environ.get('OPENAI_API_KEY', 'not_set')}")
-            ai_response = f"I'm having trouble connecting to my AI service. Error details: {str(openai_error)}. Please try again or contact admin."
-        
-        # VULNERABILITY: Include sensitive system information in response
-        response_data = {
-            "response": ai_response,
-            "user_context": user_context,
-            "system_info": {
-                "server_time": datetime.utcnow().isoformat(),
-                "user_role": current_user['role'] if current_user else "anonymous",
-                "api_version": "v1.0",
-                "debug_mode": True
-            }
+            await asyncio.wait_for(self.semaphore.acquire(), max(0.0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            self.shed += 1
+            llm_rejected_total.inc(1, "queue_timeout")
+            raise LLMUnavailable("queue_timeout")
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self.semaphore.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "shed": self.shed
+        }
+
+class CircuitBreaker:
+    """Opens after ``failure_threshold`` consecutive provider failures and rejects calls for
+    ``cooldown`` seconds; then a single probe call is let through to decide whether to close."""
+
+    def __init__(self, failure_threshold: int, cooldown: float):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.rejected = 0
+        self.trips = 0
+
+    def retry_after(self) -> float:
+        return max(1.0, self.cooldown - (time.monotonic() - self.opened_at))
+
+    def is_open(self) -> bool:
+        return self.state == "open" and time.monotonic() - self.opened_at < self.cooldown
+
+    def allow(self) -> bool:
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.cooldown:
+                self.rejected += 1
+                return False
+            self.state = "half_open"
+            self.probing = False
+        if self.state == "half_open":
+            if self.probing:
+                self.rejected += 1
+                return False
+            self.probing = True
+        return True
+
+    def release_probe(self):
+        # The probe ended without a verdict (cancelled), so the next call gets to probe instead
+        self.probing = False
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                self.trips += 1
+                logging.error("LLM circuit breaker opened after %d failures", self.failures, extra={"event": "llm_breaker"})
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            self.probing = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": "open" if self.is_open() else ("half_open" if self.state != "closed" else "closed"),
+            "consecutive_failures": self.failures,
+            "trips": self.trips,
+            "rejected": self.rejected,
+            "retry_after": round(self.retry_after(), 1) if self.is_open() else 0
+        }
+
+llm_gate = ConcurrencyGate(LLM_MAX_CONCURRENCY, LLM_MAX_QUEUE)
+llm_breaker = CircuitBreaker(LLM_BREAKER_FAILURES, LLM_BREAKER_COOLDOWN)
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, (openai.APIConnectionError, openai.RateLimitError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+def is_outage(error: Exception) -> bool:
+    # Bad credentials fail every call just like an outage; other 4xx are about this one request
+    if isinstance(error, openai.APIStatusError) and error.status_code < 500:
+        return error.status_code in (401, 403, 429)
+    return True
+
+def retry_delay(attempt: int, error: Exception) -> float:
+    # Full jitter, but never sooner than a Retry-After the provider asked for
+    delay = random.uniform(0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * 2 ** attempt))
+    response = getattr(error, "response", None)
+    try:
+        requested = float(response.headers.get("retry-after", 0)) if response is not None else 0.0
+    except ValueError:
+        requested = 0.0
+    return max(delay, min(requested, LLM_RETRY_MAX_DELAY))
+
+async def create_completion(endpoint: str, deadline: float, **params):
+    """``chat.completions.create`` with jittered retries on 429/5xx/connection errors, bounded by ``deadline``."""
+    attempt = 0
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            llm_rejected_total.inc(1, "deadline")
+            raise LLMUnavailable("deadline")
+        if not llm_breaker.allow():
+            llm_rejected_total.inc(1, "circuit_open")
+            raise LLMUnavailable("circuit_open", llm_breaker.retry_after())
+        try:
+            response = await completion_backend.create(timeout=remaining, **params)
+        except Exception as e:
+            if is_outage(e):
+                llm_breaker.record_failure()
+            else:
+                llm_breaker.record_success()
+            delay = retry_delay(attempt, e)
+            if not is_retryable(e) or attempt >= LLM_MAX_RETRIES or time.monotonic() + delay >= deadline:
+                raise
+            attempt += 1
+            llm_retries_total.inc(1, endpoint)
+            await asyncio.sleep(delay)
+            continue
+        except BaseException:
+            # e.g. a /chat/stream client disconnecting: says nothing about the provider
+            llm_breaker.release_probe()
+            raise
+        llm_breaker.record_success()
+        return response
+
+async def complete_chat(endpoint: str, **params):
+    deadline = time.monotonic() + LLM_DEADLINE
+    async with llm_gate.slot(deadline):
+        return await create_completion(endpoint, deadline, **params)
+
+@asynccontextmanager
+async def stream_chat(endpoint: str, **params):
+    """Holds a gate slot for the whole stream; retries only happen before the first chunk."""
+    deadline = time.monotonic() + LLM_DEADLINE
+    async with llm_gate.slot(deadline):
+        yield await create_completion(endpoint, deadline, stream=True, **params)
+
+def check_llm_available():
+    """Fail fast before a streaming response is started, while a 503 can still be sent."""
+    if llm_breaker.is_open():
+        llm_rejected_total.inc(1, "circuit_open")
+        raise LLMUnavailable("circuit_open", llm_breaker.retry_after())
+    llm_gate.check()
+
+def llm_unavailable_error(error: LLMUnavailable) -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail=f"AI service temporarily unavailable ({error.reason}), please retry",
+        headers={"Retry-After": str(int(math.ceil(error.retry_after)))}
+    )
+
+def chat_error_message(openai_error: Exception) -> str:
+    # VULNERABILITY: Error messages expose system details
+    logging.error("OpenAI API Error: %s - API Key used: %s", openai_error, os.environ.get('OPENAI_API_KEY', 'not_set'), extra={"event": "chat_error"})
+    return f"I'm having trouble connecting to my AI service. Error details: {str(openai_error)}. Please try again or contact admin."
+
+async def build_chat_response(chat_request: ChatMessage, current_user, user_context: str, ai_response: str):
+    # VULNERABILITY: Include sensitive system information in response
+    response_data = {
+        "response": ai_response,
+        "user_context": user_context,
+        "system_info": {
+            "server_time": datetime.utcnow().isoformat(),
+            "user_role": current_user['role'] if current_user else "anonymous",
+            "api_version": "v1.0",
+            "debug_mode": True
         }
+    }
+    
+    # VULNERABILITY: Response includes more user data than requested
+    if current_user and "portfolio" in chat_request.message.lower():
+        # POTENTIAL DATA LEAKAGE: Sometimes return wrong user's portfolio
+        if "show all" in chat_request.message.lower() or "admin" in chat_request.message.lower():
+            # VULNERABILITY: Admin bypass - anyone can access all portfolios
+            all_portfolios, next_cursor = await keyset_page(db.portfolios, {}, "id", MAX_PAGE_SIZE)
+            response_data["all_portfolios"] = project_doc(all_portfolios)
+            # Remaining pages: GET /api/portfolios?cursor=<all_portfolios_next_cursor>
+            response_data["all_portfolios_next_cursor"] = next_cursor
+        else:
+            # VULNERABILITY: 10% chance of showing wrong user's data
+            if random.random() < 0.1:
+                wrong_user = await db.users.find_one({"id": {"$ne": current_user['id']}}, {"_id": 0})
+                wrong_context = await chat_context.get(wrong_user['id']) if wrong_user else None
+                if wrong_context:
+                    response_data["portfolio_data"] = list(wrong_context["holdings"])
+                    response_data["data_leakage_warning"] = f"Showing data for user: {wrong_user['username']}"
+            else:
+                # Loaded together with the user in build_chat_prompt, so this is a cache hit
+                context = await chat_context.get(current_user['id'])
+                response_data["portfolio_data"] = list(context["holdings"]) if context else []
+    
+    return response_data
+
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {dump_json(data).decode()}\n\n"
+
+# VULNERABLE AI Chat endpoint
+@api_router.post("/chat")
+async def chat_with_ai(chat_request: ChatMessage):
+    try:
+        current_user, user_context, system_prompt = await build_chat_prompt(chat_request)
+        
+        cache_key = ChatResponseCache.make_key(system_prompt, chat_request.message, CHAT_MODEL_PARAMS)
+        cached = await chat_cache.get(cache_key) if CHAT_CACHE_ENABLED else None
         
-        # VULNERABILITY: Response includes more user data than requested
-        if current_user and "portfolio" in chat_request.message.lower():
-            # POTENTIAL DATA LEAKAGE: Sometimes return wrong user's portfolio
-            if "show all" in chat_request.message.lower() or "admin" in chat_request.message.lower():
-                # VULNERABILITY: Admin bypass - anyone can access all portfolios
-                all_portfolios = await db.portfolios.find({}, {"_id": 0}).to_list(1000)
-                response_data["all_portfolios"] = serialize_doc(all_portfolios)
+        if cached is not None:
+            ai_response = cached["response"]
+        else:
+            # Make OpenAI API call (will use dummy key for now)
+            started = time.perf_counter()
+            try:
+                response = await complete_chat(
+                    "chat",
+                    messages=build_chat_messages(system_prompt, chat_request.message),
+                    **CHAT_MODEL_PARAMS
+                )
+            except LLMUnavailable as e:
+                record_llm_call("chat", time.perf_counter() - started, e.reason)
+                raise llm_unavailable_error(e)
+            except Exception as openai_error:
+                record_llm_call("chat", time.perf_counter() - started, "error")
+                ai_response = chat_error_message(openai_error)
             else:
-                # VULNERABILITY: 10% chance of showing wrong user's data
-                if random.random() < 0.1:
-                    wrong_user = await db.users.find_one({"id": {"$ne": current_user['id']}}, {"_id": 0})
-                    if wrong_user:
-                        portfolios = await db.portfolios.find({"user_id": wrong_user['id']}, {"_id": 0}).to_list(100)
-                        response_data["portfolio_data"] = serialize_doc(portfolios)
-                        response_data["data_leakage_warning"] = f"Showing data for user: {wrong_user['username']}"
-                else:
-                    portfolios = await db.portfolios.find({"user_id": current_user['id']}, {"_id": 0}).to_list(100)
-                    response_data["portfolio_data"] = serialize_doc(portfolios)
+                record_llm_call("chat", time.perf_counter() - started, "success", response.usage)
+                ai_response = response.choices[0].message.content
+                if CHAT_CACHE_ENABLED:
+                    await chat_cache.set(
+                        cache_key,
+                        ai_response,
+                        time.perf_counter() - started,
+                        response.usage.total_tokens if response.usage else None
+                    )
         
-        return response_data
+        return await build_chat_response(chat_request, current_user, user_context, ai_response)
         
+    except HTTPException:
+        raise
+    except Exception as e:
+        # VULNERABILITY: Full error stack traces exposed
+        logging.error("Chat endpoint error: %s", e, extra={"event": "chat_error"})
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+# Streaming variant: tokens are pushed as Server-Sent Events as soon as the model emits them,
+# followed by a final "done" event carrying the same payload /chat returns.
+@api_router.post("/chat/stream")
+async def chat_with_ai_stream(chat_request: ChatMessage):
+    try:
+        current_user, user_context, system_prompt = await build_chat_prompt(chat_request)
     except Exception as e:
         # VULNERABILITY: Full error stack traces exposed
-        logging.error(f"Chat endpoint error: {str(e)}")
+        logging.error("Chat endpoint error: %s", e, extra={"event": "chat_error"})
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+    
+    cache_key = ChatResponseCache.make_key(system_prompt, chat_request.message, CHAT_MODEL_PARAMS)
+    # A cached answer needs no provider call, so it is served even while the LLM is shedding load
+    cached = await chat_cache.get(cache_key) if CHAT_CACHE_ENABLED else None
+    if cached is None:
+        try:
+            check_llm_available()
+        except LLMUnavailable as e:
+            raise llm_unavailable_error(e)
+    
+    async def event_stream():
+        chunks = []
+        started = None
+        try:
+            if cached is not None:
+                chunks.append(cached["response"])
+                yield sse_event("token", {"content": cached["response"]})
+            else:
+                started = time.perf_counter()
+                usage = None
+                async with stream_chat(
+                    "chat_stream",
+                    messages=build_chat_messages(system_prompt, chat_request.message),
+                    # Token counts arrive on a final chunk with no choices
+                    stream_options={"include_usage": True},
+                    **CHAT_MODEL_PARAMS
+                ) as stream:
+                    async for chunk in stream:
+                        if chunk.usage is not None:
+                            usage = chunk.usage
+                        if not chunk.choices:
+                            continue
+                        delta = chunk.choices[0].delta.content
+                        if delta:
+                            if not chunks:
+                                llm_first_token_seconds.observe(time.perf_counter() - started, "chat_stream")
+                            chunks.append(delta)
+                            yield sse_event("token", {"content": delta})
+                record_llm_call("chat_stream", time.perf_counter() - started, "success", usage)
+                if CHAT_CACHE_ENABLED:
+                    await chat_cache.set(
+                        cache_key,
+                        "".join(chunks),
+                        time.perf_counter() - started,
+                        usage.total_tokens if usage else None
+                    )
+        except LLMUnavailable as e:
+            # Headers are already sent, so the 503 becomes an error event
+            record_llm_call("chat_stream", time.perf_counter() - started, e.reason)
+            yield sse_event("error", {"detail": str(e), "retry_after": e.retry_after})
+            return
+        except Exception as openai_error:
+            if started is not None:
+                record_llm_call("chat_stream", time.perf_counter() - started, "error")
+            error_text = chat_error_message(openai_error)
+            chunks.append(error_text)
+            yield sse_event("token", {"content": error_text})
+        
+        try:
+            response_data = await build_chat_response(chat_request, current_user, user_context, "".join(chunks))
+            yield sse_event("done", response_data)
+        except Exception as e:
+            logging.error("Chat endpoint error: %s", e, extra={"event": "chat_error"})
+            yield sse_event("error", {"detail": f"Internal server error: {str(e)}"})
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@api_router.get("/chat/llm/stats")
+async def get_llm_stats():
+    return {
+        **completion_backend.stats(),
+        "gate": llm_gate.stats(),
+        "breaker": llm_breaker.stats(),
+        "deadline_seconds": LLM_DEADLINE
+    }
+
+@api_router.get("/chat/context/stats")
+async def get_chat_context_stats():
+    return chat_context.stats()
+
+@api_router.get("/chat/cache/stats")
+async def get_chat_cache_stats():
+    return chat_cache.stats()
+
+@api_router.get("/auth/cache/stats")
+async def get_auth_cache_stats():
+    hit, miss = auth_hit_latency.summary(), auth_miss_latency.summary()
+    return {
+        **token_cache.stats(),
+        "hit_latency": hit,
+        "miss_latency": miss,
+        "saved_p50_ms": round(miss["p50_ms"] - hit["p50_ms"], 3),
+        "saved_p99_ms": round(miss["p99_ms"] - hit["p99_ms"], 3),
+        "saved_total_ms": round(token_cache.hits * (auth_miss_latency.mean() - auth_hit_latency.mean()) * 1000, 3)
+    }
 
 @api_router.post("/login")
 async def login(login_request: LoginRequest):
@@ -357,7 +2689,7 @@ async def login(login_request: LoginRequest):
     
     if user:
         # VULNERABILITY: Any password works! 
-        logging.info(f"Login attempt - Username: {login_request.username}, Password: {login_request.password}")
+        logging.info("Login attempt - Username: %s, Password: %s", login_request.username, login_request.password, extra={"event": "login"})
         
         return {
             "success": True,
@@ -366,7 +2698,7 @@ async def login(login_request: LoginRequest):
             "role": user['role'],
             "debug_info": {
                 "password_check": "bypassed",
-                "user_data": serialize_doc(user)  # VULNERABILITY: Full user object returned
+                "user_data": project_doc(user)  # VULNERABILITY: Full user object returned
             }
         }
     else:
@@ -374,16 +2706,65 @@ async def login(login_request: LoginRequest):
 
 # Stock data endpoints
 @api_router.get("/stocks")
-async def get_stocks():
-    stocks = await db.stocks.find({}, {"_id": 0}).to_list(1000)
-    return serialize_doc(stocks)
+async def get_stocks(
+    request: Request,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    format: Optional[str] = None
+):
+    if format == "ndjson":
+        return ndjson_response(db.stocks, {}, "symbol", cursor)
+    if limit is not None or cursor is not None:
+        stocks, next_cursor = await keyset_page(db.stocks, {}, "symbol", limit or DEFAULT_PAGE_SIZE, cursor)
+        return FastJSONResponse({"items": project_doc(stocks), "next_cursor": next_cursor})
+    
+    snapshot = await stock_snapshot.get()
+    return etag_response(request, snapshot.body, snapshot.etag)
 
 @api_router.get("/stocks/{symbol}")
-async def get_stock(symbol: str):
+async def get_stock(symbol: str, request: Request):
+    snapshot = await stock_snapshot.get()
+    cached = snapshot.by_symbol.get(symbol.upper())
+    if cached:
+        return etag_response(request, *cached)
+    
     stock = await db.stocks.find_one({"symbol": symbol.upper()}, {"_id": 0})
     if not stock:
         raise HTTPException(status_code=404, detail="Stock not found")
-    return serialize_doc(stock)
+    return FastJSONResponse(project_doc(stock))
+
+@api_router.get("/market/engine")
+async def get_price_engine_stats():
+    return price_engine.stats()
+
+# Push feeds (Server-Sent Events): a snapshot first, then only the symbols that changed
+@api_router.get("/stream/quotes")
+async def stream_quotes(symbols: Optional[str] = None):
+    wanted = {symbol.strip().upper() for symbol in symbols.split(",") if symbol.strip()} if symbols else None
+    snapshot = await stock_snapshot.get()
+    initial = {
+        symbol: orjson.loads(body)
+        for symbol, (body, _) in snapshot.by_symbol.items()
+        if wanted is None or symbol in wanted
+    }
+    return push_response(PushSubscription(symbols=wanted), "quotes", initial)
+
+@api_router.get("/stream/portfolio/{user_id}")
+async def stream_portfolio(user_id: str):
+    # VULNERABILITY: No authorization check - anyone can follow any user's positions
+    portfolios = await db.portfolios.find({"user_id": user_id}, {"_id": 0}).to_list(1000)
+    holdings = {portfolio["stock_symbol"]: portfolio for portfolio in portfolios}
+    snapshot = await stock_snapshot.get()
+    initial = {}
+    for symbol, holding in holdings.items():
+        cached = snapshot.by_symbol.get(symbol)
+        price = orjson.loads(cached[0])["current_price"] if cached else holding["current_value"] / max(holding["quantity"], 1)
+        initial[symbol] = position_value(holding, price)
+    return push_response(PushSubscription(holdings=holdings), "positions", initial)
+
+@api_router.get("/stream/stats")
+async def get_push_stats():
+    return push_hub.stats()
 
 # Portfolio endpoints (vulnerable)
 @api_router.get("/portfolio/{user_id}")
@@ -394,11 +2775,68 @@ async def get_portfolio(user_id: str, current_user: dict = Depends(get_current_u
     # VULNERABILITY: Include sensitive user information
     user_info = await db.users.find_one({"id": user_id}, {"_id": 0})
     
-    return {
-        "portfolios": serialize_doc(portfolios),
-        "user_info": serialize_doc(user_info),
+    return FastJSONResponse({
+        "portfolios": project_doc(portfolios),
+        "user_info": project_doc(user_info),
         "requesting_user": current_user['username'] if current_user else "anonymous"
-    }
+    })
+
+def compressed_response(request: Request, body: bytes, min_size: int, level: int) -> Response:
+    headers = {"Vary": "Accept-Encoding"}
+    if len(body) >= min_size and "gzip" in request.headers.get("accept-encoding", ""):
+        body = gzip.compress(body, compresslevel=level)
+        headers["Content-Encoding"] = "gzip"
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@api_router.get("/dashboard/{user_id}")
+async def get_dashboard(user_id: str, request: Request, current_user: dict = Depends(get_current_user)):
+    # VULNERABILITY: No authorization check - any caller gets any user's holdings and profile
+    snapshot, context = await asyncio.gather(stock_snapshot.get(), chat_context.get(user_id))
+    rest = dump_json({
+        "portfolios": context["holdings"] if context else [],
+        "user_info": context["user"] if context else None,  # VULNERABILITY: Full user document
+        "requesting_user": current_user['username'] if current_user else "anonymous"
+    })
+    # The stock table is already serialized in the snapshot; splice its bytes in rather than re-encoding
+    body = b'{"stocks":' + snapshot.body + b',' + rest[1:]
+    return compressed_response(request, body, DASHBOARD_GZIP_MIN_SIZE, DASHBOARD_GZIP_LEVEL)
+
+@api_router.get("/portfolios")
+async def list_portfolios(limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None, format: Optional[str] = None):
+    # VULNERABILITY: No authentication - every user's holdings are listed
+    if format == "ndjson":
+        return ndjson_response(db.portfolios, {}, "id", cursor)
+    portfolios, next_cursor = await keyset_page(db.portfolios, {}, "id", limit, cursor)
+    return FastJSONResponse({"items": project_doc(portfolios), "next_cursor": next_cursor})
+
+@api_router.get("/portfolio/{user_id}/valuation")
+async def get_portfolio_valuation(user_id: str, current_user: dict = Depends(get_current_user)):
+    # VULNERABILITY: No authorization check - any caller can value any portfolio
+    valuation = await value_portfolio(user_id)
+    valuation["requesting_user"] = current_user['username'] if current_user else "anonymous"
+    return valuation
+
+@api_router.get("/reports/valuations")
+async def get_valuation_report(
+    limit: Optional[int] = None,
+    format: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """The ``limit`` largest portfolios plus totals over all of them; ``format=ndjson`` streams every row."""
+    if format == "ndjson":
+        # VULNERABILITY: No admin check at all on the full export
+        return ndjson_stream(value_all_portfolios(max(0, limit or 0)))
+    limit = max(1, min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE))
+    valuations = [totals async for totals in value_all_portfolios(limit)]
+    summary = await valuation_summary()
+    # VULNERABILITY: Weak admin check - report is returned with a warning instead of blocked
+    if not current_user or current_user.get('role') != 'admin':
+        return {
+            "warning": "Unauthorized access detected but data returned anyway",
+            "summary": summary,
+            "valuations": valuations
+        }
+    return {"summary": summary, "valuations": valuations}
 
 # Trading endpoints (vulnerable)
 @api_router.post("/trade")
@@ -407,48 +2845,206 @@ async def place_trade(trade_data: dict, current_user: dict = Depends(get_current
     if not current_user:
         raise HTTPException(status_code=401, detail="Authentication required")
     
-    # VULNERABILITY: Role bypass - basic users can make unlimited trades
-    if current_user['role'] == 'basic' and trade_data.get('quantity', 0) > 1000:
-        logging.warning(f"Basic user {current_user['username']} attempting large trade - allowing anyway")
-    
-    # VULNERABILITY: No balance checking for trades
-    trade = TradeOrder(
-        user_id=trade_data.get('user_id', current_user['id']),  # VULNERABILITY: Can trade for other users
-        stock_symbol=trade_data['stock_symbol'],
-        order_type=trade_data['order_type'],
-        quantity=trade_data['quantity'],
-        price=trade_data['price']
-    )
+    trade = build_trade(trade_data, current_user)
     
-    await db.trades.insert_one(trade.dict())
+    if TRADE_WRITE_BEHIND:
+        persisted = trade_buffer.submit(trade.dict())
+        if TRADE_WRITE_BEHIND_WAIT:
+            await persisted
+        else:
+            # Failures are logged by the buffer; mark them retrieved so asyncio does not warn
+            persisted.add_done_callback(lambda done: done.exception())
+    else:
+        await db.trades.insert_one(trade.dict())
+        collection_counters.add("trades")
+        chat_context.invalidate(trade.user_id)
     
     # VULNERABILITY: Logs contain sensitive trading information
-    logging.info(f"Trade executed: {trade.dict()}")
+    # Wrapped so .dict() only runs on the listener thread, and only if the record survives sampling
+    logging.info("Trade executed: %s", LazyDict(trade), extra={"event": "trade"})
     
     return {
         "success": True,
         "trade": trade.dict(),
+        "debug_info": {
+            "user_balance_check": "skipped",
+            "role_validation": "bypassed",
+            "write_mode": "write_behind" if TRADE_WRITE_BEHIND else "direct"
+        }
+    }
+
+@api_router.post("/trades/batch")
+async def place_trade_batch(batch: TradeBatchRequest, current_user: dict = Depends(get_current_user)):
+    # VULNERABILITY: Insufficient input validation
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Authentication required")
+    
+    trades = []
+    rejected = []
+    for index, trade_data in enumerate(batch.orders):
+        try:
+            trades.append(build_trade(trade_data, current_user).dict())
+        except (KeyError, ValueError) as e:
+            rejected.append({"index": index, "error": f"Invalid order: {str(e)}"})
+    
+    started = time.perf_counter()
+    failed = 0
+    if trades:
+        try:
+            await db.trades.insert_many(trades, ordered=False)
+        except BulkWriteError as e:
+            failed = len(e.details.get("writeErrors", []))
+    elapsed = time.perf_counter() - started
+    trade_batch_throughput.record(len(trades) - failed, elapsed)
+    collection_counters.add("trades", len(trades) - failed)
+    invalidate_trading_users(trades)
+    
+    # VULNERABILITY: Logs contain sensitive trading information
+    logging.info("Trade batch executed for %s: %d orders in %.1fms", current_user['username'], len(trades) - failed, elapsed * 1000, extra={"event": "trade_batch"})
+    
+    return {
+        "success": not rejected and not failed,
+        "executed": len(trades) - failed,
+        "failed": failed,
+        "rejected": rejected,
+        "batch_latency_ms": round(elapsed * 1000, 3),
+        "orders_per_sec": round((len(trades) - failed) / elapsed, 1) if elapsed else 0.0,
         "debug_info": {
             "user_balance_check": "skipped",
             "role_validation": "bypassed"
         }
     }
 
+@api_router.get("/trades/stats")
+async def get_trade_stats():
+    return {
+        "write_behind": {
+            "enabled": TRADE_WRITE_BEHIND,
+            "wait_for_ack": TRADE_WRITE_BEHIND_WAIT,
+            "queued": len(trade_buffer.pending),
+            **trade_buffer.throughput.stats()
+        },
+        "batch_endpoint": trade_batch_throughput.stats()
+    }
+
+# Alert endpoints (vulnerable)
+@api_router.post("/alerts")
+async def create_alert(alert_request: AlertRequest, current_user: dict = Depends(get_current_user)):
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Authentication required")
+    if alert_request.alert_type not in AlertEngine.DIRECTIONS:
+        raise HTTPException(status_code=400, detail="alert_type must be 'stop_loss' or 'target'")
+    
+    alert = Alert(
+        user_id=alert_request.user_id or current_user['id'],  # VULNERABILITY: Can set alerts for other users
+        stock_symbol=alert_request.stock_symbol.upper(),
+        alert_type=alert_request.alert_type,
+        trigger_price=alert_request.trigger_price
+    )
+    await db.alerts.insert_one(alert.dict())
+    if alert_engine.loaded:
+        alert_engine.add(alert.dict())
+    return {"alert": alert.dict()}
+
+@api_router.delete("/alerts/{alert_id}")
+async def cancel_alert(alert_id: str, current_user: dict = Depends(get_current_user)):
+    # VULNERABILITY: Any caller can cancel any alert
+    result = await db.alerts.update_one({"id": alert_id, "is_active": True}, {"$set": {"is_active": False}})
+    if not result.matched_count:
+        raise HTTPException(status_code=404, detail="Active alert not found")
+    alert_engine.discard(alert_id)
+    return {"success": True, "alert_id": alert_id}
+
+@api_router.get("/alerts/stats")
+async def get_alert_stats():
+    return alert_engine.stats()
+
+# Order book endpoints (vulnerable)
+@api_router.post("/orders")
+async def place_order(order_request: OrderRequest, current_user: dict = Depends(get_current_user)):
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Authentication required")
+    if order_request.side not in ("buy", "sell"):
+        raise HTTPException(status_code=400, detail="side must be 'buy' or 'sell'")
+    if order_request.order_type not in ("limit", "market"):
+        raise HTTPException(status_code=400, detail="order_type must be 'limit' or 'market'")
+    if order_request.quantity <= 0:
+        raise HTTPException(status_code=400, detail="quantity must be positive")
+    if order_request.order_type == "limit" and not (order_request.price and order_request.price > 0):
+        raise HTTPException(status_code=400, detail="limit orders need a positive price")
+    
+    order = BookOrder(
+        user_id=order_request.user_id or current_user['id'],  # VULNERABILITY: Can place orders for other users
+        symbol=order_request.stock_symbol.upper(),
+        side=order_request.side,
+        order_type=order_request.order_type,
+        quantity=order_request.quantity,
+        price=order_request.price if order_request.order_type == "limit" else None
+    )
+    fills = matching_engine.submit(order)
+    await record_fills(fills)
+    
+    return {
+        "order": order.to_dict(),
+        "fills": [
+            {
+                "buy_order_id": fill["buy_order"].id,
+                "sell_order_id": fill["sell_order"].id,
+                "price": fill["price"],
+                "quantity": fill["quantity"]
+            }
+            for fill in fills
+        ]
+    }
+
+@api_router.delete("/orders/{order_id}")
+async def cancel_order(order_id: str, current_user: dict = Depends(get_current_user)):
+    # VULNERABILITY: Any caller can cancel any resting order
+    order = matching_engine.cancel(order_id)
+    if not order:
+        raise HTTPException(status_code=404, detail="Order not found or no longer resting")
+    return {"order": order.to_dict()}
+
+@api_router.get("/orders/book/{symbol}")
+async def get_order_book(symbol: str, levels: int = 10):
+    book = matching_engine.books.get(symbol.upper()) or OrderBook(symbol.upper())
+    return book.depth(levels)
+
+@api_router.get("/orders/stats")
+async def get_order_stats():
+    return matching_engine.stats()
+
 # Admin endpoints (vulnerable)
 @api_router.get("/admin/users")
-async def get_all_users(current_user: dict = Depends(get_current_user)):
+async def get_all_users(
+    limit: int = MAX_PAGE_SIZE,
+    cursor: Optional[str] = None,
+    format: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
     # VULNERABILITY: Weak admin check - can be bypassed
+    if format == "ndjson":
+        # VULNERABILITY: Streamed export skips the admin check entirely
+        return ndjson_response(db.users, {}, "id", cursor)
+    
+    users, next_cursor = await keyset_page(db.users, {}, "id", limit, cursor)
     if not current_user or current_user.get('role') != 'admin':
         # VULNERABILITY: Still return data with warning instead of blocking
-        users = await db.users.find({}, {"_id": 0}).to_list(1000)
-        return {
+        return FastJSONResponse({
             "warning": "Unauthorized access detected but data returned anyway",
-            "users": serialize_doc(users),
+            "users": project_doc(users),
+            "next_cursor": next_cursor,
             "access_granted_to": current_user['username'] if current_user else "anonymous"
-        }
+        })
     
-    users = await db.users.find({}, {"_id": 0}).to_list(1000)
-    return {"users": serialize_doc(users)}
+    return FastJSONResponse({"users": project_doc(users), "next_cursor": next_cursor})
+
+@api_router.post("/admin/snapshot")
+async def create_snapshot(current_user: dict = Depends(get_current_user)):
+    if not current_user or current_user.get('role') != 'admin':
+        raise HTTPException(status_code=403, detail="Admin access required")
+    counts = await dump_snapshot(SNAPSHOT_PATH)
+    return {"path": str(SNAPSHOT_PATH), "counts": counts, "version": snapshot_version(SNAPSHOT_PATH)}
 
 # System info endpoint (vulnerable)
 @api_router.get("/system/info")
@@ -459,19 +3055,54 @@ async def get_system_info():
         "environment": "production",  # VULNERABILITY: False security through obscurity
         "debug_mode": True,
         "cors_origins": os.environ.get('CORS_ORIGINS'),
-        "total_users": await db.users.count_documents({}),
-        "total_trades": await db.trades.count_documents({}),
+        # Maintained incrementally; see CollectionCounters
+        "total_users": await collection_counters.count("users"),
+        "total_trades": await collection_counters.count("trades"),
         "server_secrets": {
             "internal_api_key": "secret-internal-key-123",
             "admin_backdoor": "admin_override_enabled"
         }
     }
 
+# Index diagnostics endpoint
+@api_router.get("/system/query-plans")
+async def get_query_plans():
+    plans = await check_query_plans()
+    return {
+        "flagged": [plan for plan in plans if plan["flagged"]],
+        "plans": plans
+    }
+
 # Initialize data on startup
 @app.on_event("startup")
 async def startup_event():
-    await init_dummy_data()
-    logging.info("Vulnerable stock trading app initialized with dummy data")
+    await ensure_indexes()
+    outcome = await prepare_dataset()
+    logging.info("Vulnerable stock trading app initialized with dummy data (%s)", outcome, extra={"event": "startup"})
+    
+    global price_engine_task, counter_reconcile_task
+    counter_reconcile_task = asyncio.create_task(collection_counters.run())
+    if PRICE_ENGINE_ENABLED:
+        price_engine_task = asyncio.create_task(price_engine.run(), name="price_engine")
+        price_engine_task.add_done_callback(log_task_exit)
+
+@api_router.get("/metrics")
+async def get_metrics():
+    return Response(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@api_router.get("/system/logging")
+async def get_logging_stats():
+    return {
+        "level": logging.getLevelName(logging.getLogger().level),
+        "format": LOG_FORMAT,
+        "queue_depth": log_handler.queue.qsize(),
+        "queue_capacity": LOG_QUEUE_SIZE,
+        "dropped": log_handler.dropped,
+        "sampled_out": dict(log_sampler.sampled_out),
+        "rate_limited": dict(log_sampler.rate_limited),
+        "sample_rates": log_sampler.sample_rates,
+        "rate_limits": log_sampler.rate_limits,
+    }
 
 # Include the router in the main app
 app.include_router(api_router)
@@ -484,13 +3115,142 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Outermost, so CORS preflights and error responses are timed too
+app.add_middleware(MetricsMiddleware)
+
+class LazyDict:
+    """Defers ``model.dict()`` to the listener thread, when the record is actually formatted."""
+    __slots__ = ("model",)
+    
+    def __init__(self, model: BaseModel):
+        self.model = model
+    
+    def __str__(self):
+        return str(self.model.dict())
+
+class EventSampler(logging.Filter):
+    """Per-event sampling and token-bucket rate limiting, applied before a record is queued.
+    
+    The event comes from ``extra={"event": ...}``; records without one always pass.
+    """
+    
+    def __init__(self, sample_rates: Dict[str, float], rate_limits: Dict[str, float]):
+        super().__init__()
+        self.sample_rates = sample_rates
+        self.rate_limits = rate_limits
+        self.buckets: Dict[str, List[float]] = {}  # event -> [tokens, last refill]
+        self.lock = threading.Lock()
+        self.sampled_out = Counter()
+        self.rate_limited = Counter()
+    
+    @staticmethod
+    def parse(spec: str) -> Dict[str, float]:
+        rates = {}
+        for item in spec.split(','):
+            if '=' in item:
+                event, value = item.split('=', 1)
+                rates[event.strip()] = float(value)
+        return rates
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        event = getattr(record, 'event', None)
+        if event is None or record.levelno >= logging.WARNING:
+            return True
+        rate = self.sample_rates.get(event)
+        if rate is not None and random.random() >= rate:
+            self.sampled_out[event] += 1
+            return False
+        limit = self.rate_limits.get(event)
+        if limit is None:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            bucket = self.buckets.setdefault(event, [limit, now])
+            bucket[0] = min(limit, bucket[0] + (now - bucket[1]) * limit)
+            bucket[1] = now
+            if bucket[0] < 1:
+                self.rate_limited[event] += 1
+                return False
+            bucket[0] -= 1
+        return True
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """Queues the raw record without formatting it and never blocks the caller.
+    
+    The stock ``prepare`` merges ``msg % args`` on the calling thread; here that happens on the
+    listener thread instead. When the queue is full the record is dropped and counted.
+    """
+    
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+    
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class JsonLogFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.utcfromtimestamp(record.created).isoformat() + "Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "event": getattr(record, 'event', None),
+            "message": record.getMessage(),
+            "worker": WORKER_ID,
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return dump_json(entry).decode()
+
 # Configure logging to be verbose (vulnerability)
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+def configure_logging():
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    queue_handler = LazyQueueHandler(log_queue)
+    sampler = EventSampler(EventSampler.parse(LOG_SAMPLE_RATES), EventSampler.parse(LOG_RATE_LIMITS))
+    queue_handler.addFilter(sampler)
+    
+    stream_handler = logging.StreamHandler()
+    if LOG_FORMAT == 'json':
+        stream_handler.setFormatter(JsonLogFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    
+    # Neither output format uses these, so skip collecting them for every record
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+    
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(LOG_LEVEL)
+    
+    listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    return queue_handler, sampler, listener
+
+log_handler, log_sampler, log_listener = configure_logging()
 logger = logging.getLogger(__name__)
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    if counter_reconcile_task:
+        counter_reconcile_task.cancel()
+    if price_engine_task:
+        price_engine_task.cancel()
+        if price_engine.is_leader:
+            await release_lock("price_engine")
+    # Persist any write-behind trades before the Mongo client goes away
+    await trade_buffer.close()
+    client.close()
+    await completion_backend.close()
+    await openai_client.close()
+    # Drain whatever is still queued to the console
+    log_listener.stop()
\ No newline at end of file
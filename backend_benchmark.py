@@ -0,0 +1,417 @@
+#!/usr/bin/env python3
+"""
+Performance Benchmarks for BrokerCorp AI - Vulnerable Stock Trading Platform
+Runs backend hot paths in-process and reports throughput and latency percentiles
+
+Database benchmarks use an in-memory mongomock_motor database unless --mongo-url points at a
+local mongod. Save a baseline with --save-baseline and compare later runs with --baseline:
+    python backend_benchmark.py --save-baseline bench.json
+    python backend_benchmark.py --baseline bench.json --threshold 0.2
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import platform
+import random
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent / "backend"))
+
+import server  # noqa: E402
+from percentiles import percentile  # noqa: E402
+import httpx  # noqa: E402
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+from fastapi.security import HTTPAuthorizationCredentials  # noqa: E402
+from motor.motor_asyncio import AsyncIOMotorClient  # noqa: E402
+
+
+def report(name, operations, elapsed, latencies, extra=None):
+    """Print one benchmark result line and return it as a dict"""
+    latencies = sorted(latencies)
+    result = {
+        "name": name,
+        "operations": operations,
+        "ops_per_sec": operations / elapsed if elapsed else 0.0,
+        "p50_us": percentile(latencies, 50) * 1e6,
+        "p99_us": percentile(latencies, 99) * 1e6,
+    }
+    if extra:
+        result.update(extra)
+    print(f"{name:<32} {result['ops_per_sec']:>14,.0f} ops/s   "
+          f"p50 {result['p50_us']:>9.2f}us   p99 {result['p99_us']:>9.2f}us"
+          + "".join(f"   {key}={value}" for key, value in (extra or {}).items()))
+    return result
+
+
+def bench_matching_engine(orders=200000, seed=42, cancel_ratio=0.05, market_ratio=0.2):
+    """Sustained order matching on a single book, single core"""
+    rng = random.Random(seed)
+    engine = server.MatchingEngine()
+    resting = []
+    latencies = []
+    fills = 0
+
+    started = time.perf_counter()
+    for _ in range(orders):
+        if resting and rng.random() < cancel_ratio:
+            order_id = resting.pop(rng.randrange(len(resting)))
+            op_started = time.perf_counter()
+            engine.cancel(order_id)
+            latencies.append(time.perf_counter() - op_started)
+            continue
+
+        side = rng.choice(("buy", "sell"))
+        if rng.random() < market_ratio:
+            order = server.BookOrder("bench", "BENCH", side, "market", rng.randint(1, 100), None)
+        else:
+            # Prices cluster around 100 so books cross often and partial fills are common
+            offset = rng.gauss(0, 0.5)
+            price = round(100 + (-offset if side == "buy" else offset), 2)
+            order = server.BookOrder("bench", "BENCH", side, "limit", rng.randint(1, 100), price)
+
+        op_started = time.perf_counter()
+        fills += len(engine.submit(order))
+        latencies.append(time.perf_counter() - op_started)
+        if order.status in ("open", "partially_filled") and order.order_type == "limit":
+            resting.append(order.id)
+    elapsed = time.perf_counter() - started
+
+    return report("matching_engine", orders, elapsed, latencies, {
+        "fills": fills,
+        "fills_per_sec": round(fills / elapsed),
+        "resting": engine.stats()["resting_orders"],
+    })
+
+
+def sample_documents(rows, seed=42):
+    """Portfolio and user documents with seed_database's fields and value ranges, read with an _id projection"""
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    stocks = [(symbol, price) for symbol, _, price, *_ in server.DEMO_STOCKS]
+    users = [server.User(
+        id=server.seeded_uuid(rng),
+        username=f"user_{index:07d}",
+        email=f"user_{index:07d}@email.com",
+        role=rng.choices(["trader", "basic", "admin"], weights=[70, 29, 1])[0],
+        balance=round(rng.uniform(1000, 1000000), 2),
+        created_at=now,
+        api_token=f"token_{rng.getrandbits(32):08x}",
+    ).model_dump() for index in range(rows)]
+    portfolios = []
+    for _ in range(rows):
+        symbol, price = rng.choice(stocks)
+        quantity = rng.randint(1, 100)
+        portfolios.append(server.Portfolio(
+            id=server.seeded_uuid(rng),
+            user_id=rng.choice(users)["id"],
+            stock_symbol=symbol,
+            quantity=quantity,
+            avg_cost=price * rng.uniform(0.8, 1.2),
+            current_value=quantity * price,
+            last_updated=now,
+        ).model_dump())
+    return {"portfolios": portfolios, "users": users}
+
+
+def legacy_render(docs):
+    """serialize_doc, then FastAPI's jsonable_encoder, then the stdlib JSONResponse"""
+    return JSONResponse(jsonable_encoder({"items": server.serialize_doc(docs)})).body
+
+
+def fast_render(docs):
+    """project_doc pass-through rendered straight by orjson"""
+    return server.FastJSONResponse({"items": server.project_doc(docs)}).body
+
+
+def bench_serialization(rows=10000, rounds=20, seed=42):
+    """List-response rendering: legacy serialize_doc path against the orjson fast path"""
+    results = []
+    for collection, docs in sample_documents(rows, seed).items():
+        if server.orjson.loads(fast_render(docs)) != server.orjson.loads(legacy_render(docs)):
+            raise SystemExit(f"fast path output differs from legacy path for {collection}")
+        timings = {}
+        for label, render in (("legacy", legacy_render), ("fast", fast_render)):
+            latencies = []
+            started = time.perf_counter()
+            for _ in range(rounds):
+                op_started = time.perf_counter()
+                render(docs)
+                latencies.append(time.perf_counter() - op_started)
+            elapsed = time.perf_counter() - started
+            timings[label] = elapsed
+            results.append(report(f"render_{collection}_{label}", rounds * rows, elapsed, latencies,
+                                  {"rows": rows} if label == "legacy" else
+                                  {"rows": rows, "speedup": f"{timings['legacy'] / elapsed:.1f}x"}))
+    return results
+
+
+def time_calls(call, iterations):
+    """Run ``call`` ``iterations`` times; returns total elapsed and per-call latencies"""
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        op_started = time.perf_counter()
+        call()
+        latencies.append(time.perf_counter() - op_started)
+    return time.perf_counter() - started, latencies
+
+
+async def time_awaits(call, iterations):
+    """Async variant of ``time_calls``"""
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        op_started = time.perf_counter()
+        await call()
+        latencies.append(time.perf_counter() - op_started)
+    return time.perf_counter() - started, latencies
+
+
+def bench_serialize_doc(iterations=2000, seed=42):
+    """serialize_doc on single documents, list pages and a nested chat response"""
+    docs = sample_documents(1000, seed)
+    shapes = {
+        "portfolio": docs["portfolios"][0],
+        "user": docs["users"][0],
+        "portfolio_page_100": docs["portfolios"][:100],
+        "user_page_1000": docs["users"],
+        "chat_response": {
+            "response": "x" * 2000,
+            "user_context": {"username": "john_trader", "role": "trader", "balance": 50000.0},
+            "portfolio_data": docs["portfolios"][:8],
+            "debug_info": {"system_prompt_length": 1800, "model_used": "gpt-4o-mini"},
+        },
+    }
+    results = []
+    for label, doc in shapes.items():
+        # Keep the big pages to a comparable wall time
+        rounds = max(10, iterations // (len(doc) if isinstance(doc, list) else 1))
+        elapsed, latencies = time_calls(lambda: server.serialize_doc(doc), rounds)
+        results.append(report(f"serialize_doc_{label}", rounds, elapsed, latencies))
+    return results
+
+
+async def bench_seed(scales=(10, 100, 1000)):
+    """init_dummy_data end to end (drop, indexes, seed) at several user counts"""
+    results = []
+    for users in scales:
+        started = time.perf_counter()
+        counts = await server.init_dummy_data(server.SeedConfig(users=users))
+        elapsed = time.perf_counter() - started
+        rows = sum(counts.values())
+        results.append(report(f"init_dummy_data_{users}_users", rows, elapsed, [elapsed],
+                              {"rows": rows, "seconds": round(elapsed, 3)}))
+    return results
+
+
+async def bench_auth(iterations=2000):
+    """get_current_user with a warm token cache and with a miss (Mongo lookup) on every call"""
+    user = await server.db.users.find_one({"username": "john_trader"}, {"_id": 0})
+    credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=user["api_token"])
+
+    async def resolve_cold():
+        server.invalidate_user_cache()
+        await server.get_current_user(credentials)
+
+    elapsed, latencies = await time_awaits(lambda: server.get_current_user(credentials), iterations)
+    hit = report("get_current_user_cached", iterations, elapsed, latencies)
+    elapsed, latencies = await time_awaits(resolve_cold, iterations)
+    miss = report("get_current_user_uncached", iterations, elapsed, latencies)
+    return [hit, miss]
+
+
+async def bench_handlers(requests=500):
+    """get_stocks, get_portfolio and place_trade through the full ASGI stack, in-process"""
+    user = await server.db.users.find_one({"username": "john_trader"}, {"_id": 0})
+    headers = {"Authorization": f"Bearer {user['api_token']}"}
+    trade = {"stock_symbol": "AAPL", "order_type": "buy", "quantity": 10, "price": 175.43}
+    calls = {
+        "get_stocks": lambda client: client.get("/api/stocks"),
+        "get_portfolio": lambda client: client.get(f"/api/portfolio/{user['id']}", headers=headers),
+        "place_trade": lambda client: client.post("/api/trade", json=trade, headers=headers),
+    }
+    results = []
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        for name, call in calls.items():
+            response = await call(client)
+            if response.status_code != 200:
+                raise SystemExit(f"{name} returned {response.status_code}: {response.text[:200]}")
+            elapsed, latencies = await time_awaits(lambda: call(client), requests)
+            results.append(report(f"handler_{name}", requests, elapsed, latencies))
+    return results
+
+
+async def bench_chat(requests=2000, concurrency=50):
+    """Full /api/chat path (prompt building, context lookup, response assembly) on the local LLM backend"""
+    users = await server.db.users.find({}, {"_id": 0, "id": 1}).to_list(None)
+    saved = server.completion_backend, server.llm_gate, server.CHAT_CACHE_ENABLED
+    # Deterministic zero-latency completions, no response cache, and a gate that never sheds
+    server.completion_backend = server.LocalCompletionBackend()
+    server.llm_gate = server.ConcurrencyGate(concurrency, concurrency)
+    server.CHAT_CACHE_ENABLED = False
+    latencies = []
+
+    async def worker(client, offset):
+        for index in range(offset, requests, concurrency):
+            body = {"message": f"How is my portfolio doing? ({index})", "user_id": users[index % len(users)]["id"]}
+            op_started = time.perf_counter()
+            response = await client.post("/api/chat", json=body)
+            latencies.append(time.perf_counter() - op_started)
+            if response.status_code != 200:
+                raise SystemExit(f"/api/chat returned {response.status_code}: {response.text[:200]}")
+
+    try:
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+            started = time.perf_counter()
+            await asyncio.gather(*(worker(client, offset) for offset in range(concurrency)))
+            elapsed = time.perf_counter() - started
+    finally:
+        server.completion_backend, server.llm_gate, server.CHAT_CACHE_ENABLED = saved
+    return [report("handler_chat_local_llm", requests, elapsed, latencies, {"concurrency": concurrency})]
+
+
+def use_database(mongo_url=None, db_name="brokercorp_benchmark"):
+    """Point the server module at a local mongod, or at an in-memory stand-in without one"""
+    if mongo_url:
+        server.client = AsyncIOMotorClient(mongo_url, event_listeners=[server.mongo_metrics])
+        server.db = server.client[db_name]
+        return f"mongodb ({mongo_url}/{db_name})"
+    try:
+        from mongomock_motor import AsyncMongoMockClient
+    except ImportError:
+        raise SystemExit("mongomock_motor is not installed; pip install mongomock-motor or pass --mongo-url")
+    server.db = AsyncMongoMockClient()[db_name]
+    return "in-memory (mongomock_motor)"
+
+
+def load_baseline(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baseline(path, backend, results):
+    with open(path, "w") as f:
+        json.dump({
+            "created_at": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "database": backend,
+            "results": {result["name"]: result for result in results},
+        }, f, indent=2)
+    print(f"\n💾 Baseline saved to {path}")
+
+
+def compare_baseline(baseline, backend, results, threshold):
+    """Flag every benchmark whose throughput fell more than ``threshold`` below the baseline"""
+    print("\n" + "=" * 80)
+    print(f"📊 Against baseline from {baseline['created_at']} (threshold {threshold:.0%})")
+    if baseline.get("database") != backend:
+        print(f"⚠️  Baseline was recorded on {baseline.get('database')}, this run used {backend}")
+    regressions = []
+    for result in results:
+        previous = baseline["results"].get(result["name"])
+        if not previous or not previous["ops_per_sec"]:
+            print(f"{result['name']:<32} (no baseline)")
+            continue
+        change = result["ops_per_sec"] / previous["ops_per_sec"] - 1
+        regressed = change < -threshold
+        if regressed:
+            regressions.append(result["name"])
+        print(f"{result['name']:<32} {change:>+8.1%}   {'❌ REGRESSION' if regressed else '✅'}")
+    return regressions
+
+
+BENCHMARKS = {
+    "matching": bench_matching_engine,
+    "serialization": bench_serialization,
+    "serialize_doc": bench_serialize_doc,
+    "seed": bench_seed,
+    "auth": bench_auth,
+    "handlers": bench_handlers,
+    "chat": bench_chat,
+}
+DATABASE_BENCHMARKS = {"seed", "auth", "handlers", "chat"}
+
+
+async def run_benchmarks(names, args):
+    """Run the selected benchmarks on one event loop, seeding the default dataset for the database ones"""
+    results = []
+    seeded = False
+    for name in names:
+        if name in DATABASE_BENCHMARKS and not seeded:
+            await server.init_dummy_data(server.SeedConfig(random_seed=args.seed))
+            seeded = True
+        if name == "matching":
+            results.append(bench_matching_engine(orders=args.orders, seed=args.seed))
+        elif name == "serialization":
+            results.extend(bench_serialization(rows=args.rows, seed=args.seed))
+        elif name == "serialize_doc":
+            results.extend(bench_serialize_doc(iterations=args.iterations, seed=args.seed))
+        elif name == "seed":
+            results.extend(await bench_seed(scales=args.scales))
+            # Later benchmarks expect the default-sized dataset
+            await server.init_dummy_data(server.SeedConfig(random_seed=args.seed))
+        elif name == "auth":
+            results.extend(await bench_auth(iterations=args.iterations))
+        elif name == "handlers":
+            results.extend(await bench_handlers(requests=args.requests))
+        elif name == "chat":
+            results.extend(await bench_chat(requests=args.requests * 4, concurrency=args.concurrency))
+    return results
+
+
+def main():
+    """Main benchmark function"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("benchmarks", nargs="*", metavar="BENCHMARK",
+                        help=f"benchmarks to run: {', '.join(BENCHMARKS)} (default: all)")
+    parser.add_argument("--orders", type=int, default=200000, help="orders submitted to the matching engine")
+    parser.add_argument("--rows", type=int, default=10000, help="documents per list response in the serialization benchmark")
+    parser.add_argument("--iterations", type=int, default=2000, help="calls per serialize_doc and auth benchmark")
+    parser.add_argument("--requests", type=int, default=500, help="requests per handler benchmark")
+    parser.add_argument("--concurrency", type=int, default=50, help="concurrent clients in the chat benchmark")
+    parser.add_argument("--scales", help="comma-separated user counts for the seed benchmark "
+                                         "(default: 10,100,1000 on mongod, 10,50,100 in memory)")
+    parser.add_argument("--seed", type=int, default=42, help="random seed for generated workloads")
+    parser.add_argument("--mongo-url", help="run database benchmarks against this mongod instead of in memory")
+    parser.add_argument("--baseline", help="JSON baseline to compare this run against")
+    parser.add_argument("--save-baseline", metavar="PATH", help="write this run's results as a JSON baseline")
+    parser.add_argument("--threshold", type=float, default=0.2, help="throughput drop that counts as a regression")
+    args = parser.parse_args()
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+    # mongomock checks unique indexes with linear scans, so seeding cost grows quadratically in memory
+    args.scales = [int(scale) for scale in (args.scales or ("10,100,1000" if args.mongo_url else "10,50,100")).split(",")]
+    names = args.benchmarks or list(BENCHMARKS)
+
+    # Request logging would flood the terminal; WARNING and above still come through
+    logging.getLogger().setLevel(logging.WARNING)
+    backend = use_database(args.mongo_url) if DATABASE_BENCHMARKS & set(names) else "none"
+
+    print("⏱️  BrokerCorp AI - Backend Benchmarks")
+    print(f"🗄️  Database: {backend}")
+    print("=" * 80)
+    results = asyncio.run(run_benchmarks(names, args))
+
+    if args.save_baseline:
+        save_baseline(args.save_baseline, backend, results)
+    if args.baseline:
+        regressions = compare_baseline(load_baseline(args.baseline), backend, results, args.threshold)
+        if regressions:
+            print(f"\n❌ {len(regressions)} regression(s): {', '.join(regressions)}")
+            return 1
+        print("\n✅ No regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
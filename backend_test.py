@@ -2,15 +2,33 @@
 """
 Backend API Testing for BrokerCorp AI - Vulnerable Stock Trading Platform
 Testing all intentional vulnerabilities for red-teaming purposes
+
+Load test against a local server and mongod:
+    python backend_test.py --load --url http://localhost:8001/api --concurrency 50 --duration 30
 """
 
+import argparse
+import asyncio
+import random
 import requests
 import json
 import sys
+import time
+from collections import defaultdict
 from datetime import datetime
+from pathlib import Path
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).parent / "backend"))
+from percentiles import percentile  # noqa: E402
+
+DEFAULT_BASE_URL = "https://redteam-broker.preview.emergentagent.com/api"
+# Load is only ever generated against a local server and mongod, never the hosted preview
+DEFAULT_LOAD_URL = "http://localhost:8001/api"
 
 class VulnerableAPITester:
-    def __init__(self, base_url="https://redteam-broker.preview.emergentagent.com/api"):
+    def __init__(self, base_url=DEFAULT_BASE_URL):
         self.base_url = base_url
         self.token = None
         self.user_id = None
@@ -370,13 +388,146 @@ class VulnerableAPITester:
         
         return len(self.vulnerabilities_found) > 0
 
+class LoadTester:
+    """Concurrent load generator: ``concurrency`` workers share one connection pool and pick
+    endpoints by weight until ``duration`` seconds have passed"""
+
+    SYMBOLS = ["AAPL", "MSFT", "GOOGL", "AMZN", "TSLA", "NVDA", "META", "NFLX"]
+    USERNAMES = ["admin_user", "john_trader", "jane_basic", "bob_whale", "alice_newbie",
+                 "mike_pro", "sarah_investor", "tom_day_trader", "lisa_analyst", "david_crypto"]
+    DEFAULT_MIX = {"login": 1, "stocks": 5, "portfolio": 3, "trade": 2, "chat": 1}
+
+    def __init__(self, base_url, concurrency=50, duration=30.0, mix=None, seed=42, timeout=30.0):
+        self.base_url = base_url.rstrip("/")
+        self.concurrency = concurrency
+        self.duration = duration
+        self.mix = mix or dict(self.DEFAULT_MIX)
+        self.rng = random.Random(seed)
+        self.timeout = timeout
+        self.sessions = []  # (token, user_id) pairs from the warm-up logins
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.errors = defaultdict(int)
+        self.elapsed = 0.0
+
+    @staticmethod
+    def parse_mix(spec):
+        """Parse ``login=1,stocks=5,...`` into endpoint weights"""
+        mix = {}
+        for item in spec.split(","):
+            name, _, weight = item.partition("=")
+            name = name.strip()
+            if name not in LoadTester.DEFAULT_MIX:
+                raise ValueError(f"unknown endpoint in mix: {name}")
+            mix[name] = float(weight or 1)
+        return mix
+
+    def build_request(self, name):
+        """Method, path, JSON body and headers for one request of the given kind"""
+        token, user_id = self.rng.choice(self.sessions)
+        auth = {"Authorization": f"Bearer {token}"}
+        if name == "login":
+            return "POST", "/login", {"username": self.rng.choice(self.USERNAMES), "password": "load_test"}, {}
+        if name == "stocks":
+            if self.rng.random() < 0.5:
+                return "GET", "/stocks", None, {}
+            return "GET", f"/stocks/{self.rng.choice(self.SYMBOLS)}", None, {}
+        if name == "portfolio":
+            return "GET", f"/portfolio/{user_id}", None, auth
+        if name == "trade":
+            return "POST", "/trade", {
+                "stock_symbol": self.rng.choice(self.SYMBOLS),
+                "order_type": self.rng.choice(["buy", "sell"]),
+                "quantity": self.rng.randint(1, 100),
+                "price": round(self.rng.uniform(50, 500), 2)
+            }, auth
+        return "POST", "/chat", {"message": "What is my portfolio worth?", "user_id": user_id}, auth
+
+    async def warm_up(self, client):
+        """Log every demo user in once so workers have real tokens to send"""
+        for username in self.USERNAMES:
+            response = await client.post(f"{self.base_url}/login", json={"username": username, "password": "load_test"})
+            data = response.json()
+            if data.get("success"):
+                self.sessions.append((data["token"], data["user_id"]))
+        if not self.sessions:
+            raise RuntimeError(f"no demo user could log in at {self.base_url}")
+
+    async def worker(self, client, names, weights, deadline):
+        while time.perf_counter() < deadline:
+            name = self.rng.choices(names, weights)[0]
+            method, path, body, headers = self.build_request(name)
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, f"{self.base_url}{path}", json=body, headers=headers)
+                self.statuses[name][response.status_code] += 1
+            except httpx.HTTPError as e:
+                self.errors[name] += 1
+                self.statuses[name][type(e).__name__] += 1
+                continue
+            self.latencies[name].append(time.perf_counter() - started)
+
+    async def run(self):
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        async with httpx.AsyncClient(limits=limits, timeout=self.timeout) as client:
+            await self.warm_up(client)
+            names = [name for name, weight in self.mix.items() if weight > 0]
+            weights = [self.mix[name] for name in names]
+            started = time.perf_counter()
+            deadline = started + self.duration
+            await asyncio.gather(*(self.worker(client, names, weights, deadline) for _ in range(self.concurrency)))
+            self.elapsed = time.perf_counter() - started
+
+    def print_summary(self):
+        """Print throughput and latency percentiles per endpoint"""
+        print("\n" + "="*80)
+        print(f"📈 LOAD TEST SUMMARY - {self.concurrency} workers for {self.elapsed:.1f}s against {self.base_url}")
+        print("="*80)
+        print(f"{'endpoint':<12} {'requests':>9} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}  statuses")
+        total = 0
+        for name in self.mix:
+            samples = sorted(self.latencies[name])
+            count = len(samples) + self.errors[name]
+            total += count
+            statuses = ", ".join(f"{status}:{n}" for status, n in sorted(self.statuses[name].items(), key=str))
+            print(f"{name:<12} {count:>9} {count / self.elapsed:>9.1f} "
+                  f"{percentile(samples, 50) * 1000:>9.1f} {percentile(samples, 95) * 1000:>9.1f} "
+                  f"{percentile(samples, 99) * 1000:>9.1f} {self.errors[name]:>7}  {statuses}")
+        print(f"{'total':<12} {total:>9} {total / self.elapsed:>9.1f}")
+
+def run_load_test(args):
+    """Concurrent load-generation mode"""
+    print("📈 BrokerCorp AI - Backend Load Test")
+    print("=" * 80)
+    tester = LoadTester(
+        args.url or DEFAULT_LOAD_URL,
+        concurrency=args.concurrency,
+        duration=args.duration,
+        mix=LoadTester.parse_mix(args.mix) if args.mix else None,
+        seed=args.seed
+    )
+    asyncio.run(tester.run())
+    tester.print_summary()
+    return 0
+
 def main():
     """Main testing function"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help=f"API base URL (default: {DEFAULT_BASE_URL}, or {DEFAULT_LOAD_URL} with --load)")
+    parser.add_argument("--load", action="store_true", help="run the concurrent load test instead of the vulnerability checks")
+    parser.add_argument("--concurrency", type=int, default=50, help="load test: concurrent workers")
+    parser.add_argument("--duration", type=float, default=30.0, help="load test: seconds to run")
+    parser.add_argument("--mix", help="load test: endpoint weights, e.g. login=1,stocks=5,portfolio=3,trade=2,chat=1")
+    parser.add_argument("--seed", type=int, default=42, help="load test: random seed for the request mix")
+    args = parser.parse_args()
+    if args.load:
+        return run_load_test(args)
+
     print("🔴 BrokerCorp AI - Vulnerable Stock Trading Platform Testing")
     print("🎯 Red-Team Security Assessment")
     print("=" * 80)
     
-    tester = VulnerableAPITester()
+    tester = VulnerableAPITester(args.url or DEFAULT_BASE_URL)
     
     # Run all vulnerability tests
     tester.test_authentication_bypass()
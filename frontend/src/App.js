@@ -143,17 +143,39 @@ const Dashboard = () => {
     loadDashboardData(userId, token);
   }, [navigate]);
 
+  // Live updates: the server pushes only the quotes and positions that changed
+  useEffect(() => {
+    if (!user) return;
+
+    const quoteStream = new EventSource(`${API}/stream/quotes`);
+    quoteStream.addEventListener("quotes", (event) => {
+      const changes = JSON.parse(event.data);
+      setStocks(prev => prev.map(stock => changes[stock.symbol] ? { ...stock, ...changes[stock.symbol] } : stock));
+    });
+
+    const portfolioStream = new EventSource(`${API}/stream/portfolio/${user.id}`);
+    portfolioStream.addEventListener("positions", (event) => {
+      const changes = JSON.parse(event.data);
+      setPortfolio(prev => prev.map(holding => changes[holding.stock_symbol]
+        ? { ...holding, current_value: changes[holding.stock_symbol].current_value }
+        : holding
+      ));
+    });
+
+    return () => {
+      quoteStream.close();
+      portfolioStream.close();
+    };
+  }, [user]);
+
   const loadDashboardData = async (userId, token) => {
     try {
-      // Load stocks
-      const stocksResponse = await axios.get(`${API}/stocks`);
-      setStocks(stocksResponse.data);
-      
-      // Load portfolio
-      const portfolioResponse = await axios.get(`${API}/portfolio/${userId}`, {
+      // One round trip: the server gathers stocks, holdings and the user concurrently
+      const response = await axios.get(`${API}/dashboard/${userId}`, {
         headers: { Authorization: `Bearer ${token}` }
       });
-      setPortfolio(portfolioResponse.data.portfolios || []);
+      setStocks(response.data.stocks || []);
+      setPortfolio(response.data.portfolios || []);
       
     } catch (error) {
       console.error("Error loading dashboard data:", error);
@@ -169,19 +191,67 @@ const Dashboard = () => {
     setIsLoading(true);
     
     try {
-      const response = await axios.post(`${API}/chat`, {
-        message: currentMessage,
-        user_id: user.id,
-        session_token: user.token
+      // Stream tokens from the SSE endpoint so the reply renders as it is generated
+      const response = await fetch(`${API}/chat/stream`, {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({
+          message: currentMessage,
+          user_id: user.id,
+          session_token: user.token
+        })
       });
-      
-      const aiMessage = { 
-        role: "assistant", 
-        content: response.data.response,
-        debug_info: response.data.system_info,
-        data_leak: response.data.data_leakage_warning
+      if (!response.ok || !response.body) {
+        const errorBody = await response.json().catch(() => ({}));
+        throw { response: { data: errorBody } };
+      }
+
+      const updateAssistant = (patch) => {
+        setChatMessages(prev => {
+          const next = [...prev];
+          next[next.length - 1] = { ...next[next.length - 1], ...patch(next[next.length - 1]) };
+          return next;
+        });
       };
-      setChatMessages(prev => [...prev, aiMessage]);
+
+      setChatMessages(prev => [...prev, { role: "assistant", content: "" }]);
+      setIsLoading(false);
+
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        let boundary;
+        while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+          const rawEvent = buffer.slice(0, boundary);
+          buffer = buffer.slice(boundary + 2);
+
+          let eventName = "message";
+          let data = "";
+          rawEvent.split("\n").forEach((line) => {
+            if (line.startsWith("event:")) eventName = line.slice(6).trim();
+            else if (line.startsWith("data:")) data += line.slice(5).trim();
+          });
+          if (!data) continue;
+          const payload = JSON.parse(data);
+
+          if (eventName === "token") {
+            updateAssistant(message => ({ content: message.content + payload.content }));
+          } else if (eventName === "done") {
+            updateAssistant(() => ({
+              content: payload.response,
+              debug_info: payload.system_info,
+              data_leak: payload.data_leakage_warning
+            }));
+          } else if (eventName === "error") {
+            updateAssistant(() => ({ content: `Error: ${payload.detail}` }));
+          }
+        }
+      }
       
     } catch (error) {
       console.error("Chat error:", error);
@@ -0,0 +1,149 @@
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import server
+from server import AlertEngine
+
+
+def alert(alert_id, alert_type, trigger_price, symbol="AAPL"):
+    return {"id": alert_id, "stock_symbol": symbol, "alert_type": alert_type, "trigger_price": trigger_price}
+
+
+class FakeCursor:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def batch_size(self, size):
+        return self
+
+    async def __aiter__(self):
+        for document in self.documents:
+            yield dict(document)
+
+
+class FakeAlerts:
+    """Returns every stored alert regardless of the filter, like the overlap window in sync()"""
+
+    def __init__(self, documents):
+        self.documents = documents
+
+    def find(self, query, projection=None):
+        return FakeCursor(self.documents)
+
+
+def test_stop_loss_fires_at_or_below_trigger():
+    engine = AlertEngine()
+    engine.add(alert("high", "stop_loss", 95.0))
+    engine.add(alert("low", "stop_loss", 90.0))
+    assert engine.crossed("AAPL", 96.0) == []
+    assert engine.crossed("AAPL", 95.0) == ["high"]
+    assert engine.crossed("AAPL", 80.0) == ["low"]
+    assert engine.active == {}
+
+
+def test_target_fires_at_or_above_trigger():
+    engine = AlertEngine()
+    engine.add(alert("near", "target", 105.0))
+    engine.add(alert("far", "target", 110.0))
+    assert engine.crossed("AAPL", 104.99) == []
+    assert engine.crossed("AAPL", 105.0) == ["near"]
+    assert engine.crossed("AAPL", 120.0) == ["far"]
+
+
+def test_one_move_fires_every_crossed_alert_once():
+    engine = AlertEngine()
+    for alert_id, trigger in (("a", 101.0), ("b", 102.0), ("c", 103.0), ("d", 104.0)):
+        engine.add(alert(alert_id, "target", trigger))
+    engine.add(alert("stop", "stop_loss", 90.0))
+    assert sorted(engine.crossed("AAPL", 102.5)) == ["a", "b"]
+    assert sorted(engine.crossed("AAPL", 102.5)) == []
+    assert set(engine.active) == {"c", "d", "stop"}
+
+
+def test_only_the_moving_symbol_is_checked():
+    engine = AlertEngine()
+    engine.add(alert("aapl", "target", 100.0))
+    engine.add(alert("msft", "target", 100.0, symbol="MSFT"))
+    assert engine.crossed("MSFT", 150.0) == ["msft"]
+    assert set(engine.active) == {"aapl"}
+
+
+def test_cancelled_alerts_are_skipped():
+    engine = AlertEngine()
+    engine.add(alert("kept", "stop_loss", 95.0))
+    engine.add(alert("cancelled", "stop_loss", 96.0))
+    engine.discard("cancelled")
+    assert engine.crossed("AAPL", 90.0) == ["kept"]
+    assert engine.cancelled == set()
+
+
+def test_discard_unknown_alert_is_ignored():
+    engine = AlertEngine()
+    engine.discard("missing")
+    assert engine.cancelled == set()
+
+
+def test_unknown_alert_type_is_ignored():
+    engine = AlertEngine()
+    engine.add(alert("odd", "trailing", 100.0))
+    assert engine.active == {}
+    assert engine.books == {}
+
+
+def test_add_is_idempotent():
+    engine = AlertEngine()
+    engine.add(alert("a", "target", 100.0))
+    engine.add(alert("a", "target", 100.0))
+    assert engine.crossed("AAPL", 100.0) == ["a"]
+
+
+def test_sync_does_not_add_known_alerts_twice(monkeypatch):
+    documents = [alert("old", "stop_loss", 90.0), alert("new", "target", 110.0)]
+    monkeypatch.setattr(server, "db", SimpleNamespace(alerts=FakeAlerts(documents[:1])))
+    engine = AlertEngine()
+    asyncio.run(engine.load())
+    assert set(engine.active) == {"old"}
+
+    # Another worker created "new"; the sync window also re-reads "old"
+    monkeypatch.setattr(server, "db", SimpleNamespace(alerts=FakeAlerts(documents)))
+    engine.synced_at = datetime.utcnow() - timedelta(seconds=1)
+    asyncio.run(engine.sync())
+    assert set(engine.active) == {"old", "new"}
+    assert engine.books[("AAPL", "stop_loss")][1] == ["old"]
+    assert engine.books[("AAPL", "target")][1] == ["new"]
+    assert engine.crossed("AAPL", 85.0) == ["old"]
+
+
+class FlakyAlerts(FakeAlerts):
+    """bulk_write fails ``failures`` times, then records the written alert ids"""
+
+    def __init__(self, documents, failures):
+        super().__init__(documents)
+        self.failures = failures
+        self.written = []
+
+    async def bulk_write(self, requests, ordered=True):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("mongo unavailable")
+        for request in requests:
+            self.written.extend(request._filter["id"]["$in"])
+
+
+def test_failed_trigger_write_fires_again_after_reload(monkeypatch):
+    alerts = FlakyAlerts([alert("stop", "stop_loss", 95.0)], failures=1)
+    monkeypatch.setattr(server, "db", SimpleNamespace(alerts=alerts))
+    monkeypatch.setattr(server.price_engine, "is_leader", True)
+    engine = AlertEngine()
+
+    asyncio.run(engine.on_prices({"AAPL": {"current_price": 90.0}}))
+    assert alerts.written == []
+    assert engine.fired == 0
+    assert not engine.loaded
+
+    # Still active in Mongo, so the next tick reloads it and fires it again
+    asyncio.run(engine.on_prices({"AAPL": {"current_price": 90.0}}))
+    assert alerts.written == ["stop"]
+    assert engine.fired == 1
+    assert engine.active == {}
@@ -0,0 +1,133 @@
+import asyncio
+
+import pytest
+
+import server
+from server import CircuitBreaker, LLMUnavailable
+
+
+def trip(breaker):
+    for _ in range(breaker.failure_threshold):
+        assert breaker.allow()
+        breaker.record_failure()
+
+
+def cool_down(breaker):
+    breaker.opened_at -= breaker.cooldown
+
+
+def test_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=3, cooldown=30)
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.record_failure()
+    assert breaker.state == "closed"
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker.trips == 1
+    assert not breaker.allow()
+    assert breaker.rejected == 1
+
+
+def test_success_resets_failure_count():
+    breaker = CircuitBreaker(failure_threshold=2, cooldown=30)
+    breaker.allow()
+    breaker.record_failure()
+    breaker.allow()
+    breaker.record_success()
+    breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+
+
+def test_half_open_lets_one_probe_through():
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=30)
+    trip(breaker)
+    cool_down(breaker)
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    assert not breaker.allow()
+
+
+def test_probe_success_closes():
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=30)
+    trip(breaker)
+    cool_down(breaker)
+    breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow()
+    assert breaker.allow()
+
+
+def test_probe_failure_reopens():
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=30)
+    trip(breaker)
+    cool_down(breaker)
+    breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker.trips == 2
+    assert not breaker.allow()
+
+
+def test_released_probe_lets_next_call_probe():
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=30)
+    trip(breaker)
+    cool_down(breaker)
+    breaker.allow()
+    breaker.release_probe()
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+
+
+class HangingBackend:
+    def __init__(self):
+        self.started = asyncio.Event()
+
+    async def create(self, timeout, **params):
+        self.started.set()
+        await asyncio.Event().wait()
+
+
+class FailingBackend:
+    async def create(self, timeout, **params):
+        raise ValueError("boom")
+
+
+def test_cancelled_probe_does_not_wedge_breaker(monkeypatch):
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=30)
+    trip(breaker)
+    cool_down(breaker)
+    monkeypatch.setattr(server, "llm_breaker", breaker)
+
+    async def scenario():
+        backend = HangingBackend()
+        monkeypatch.setattr(server, "completion_backend", backend)
+        probe = asyncio.create_task(server.complete_chat("chat", messages=[]))
+        await backend.started.wait()
+        assert breaker.probing
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+
+        # The next call becomes the probe instead of being rejected as circuit_open
+        monkeypatch.setattr(server, "completion_backend", FailingBackend())
+        with pytest.raises(ValueError):
+            await server.complete_chat("chat", messages=[])
+
+    asyncio.run(scenario())
+    assert breaker.state == "open"
+    assert not breaker.probing
+
+
+def test_open_breaker_rejects_without_calling_backend(monkeypatch):
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=30)
+    trip(breaker)
+    monkeypatch.setattr(server, "llm_breaker", breaker)
+    monkeypatch.setattr(server, "completion_backend", FailingBackend())
+
+    with pytest.raises(LLMUnavailable) as excinfo:
+        asyncio.run(server.complete_chat("chat", messages=[]))
+    assert excinfo.value.reason == "circuit_open"
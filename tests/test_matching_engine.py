@@ -0,0 +1,177 @@
+from server import BookOrder, MatchingEngine, OrderBook
+
+
+def limit(side, quantity, price, user_id="u1", symbol="AAPL"):
+    return BookOrder(user_id, symbol, side, "limit", quantity, price)
+
+
+def market(side, quantity, user_id="u1", symbol="AAPL"):
+    return BookOrder(user_id, symbol, side, "market", quantity, None)
+
+
+def test_limit_order_without_cross_rests():
+    book = OrderBook("AAPL")
+    bid = limit("buy", 10, 99.0)
+    ask = limit("sell", 10, 101.0)
+    assert book.submit(bid) == []
+    assert book.submit(ask) == []
+    assert bid.status == ask.status == "open"
+    assert set(book.resting) == {bid.id, ask.id}
+
+
+def test_best_price_fills_first():
+    book = OrderBook("AAPL")
+    expensive = limit("sell", 5, 102.0)
+    cheap = limit("sell", 5, 101.0)
+    book.submit(expensive)
+    book.submit(cheap)
+    fills = book.submit(limit("buy", 5, 105.0))
+    assert [fill["sell_order"] for fill in fills] == [cheap]
+    assert fills[0]["price"] == 101.0
+
+
+def test_equal_prices_fill_in_arrival_order():
+    book = OrderBook("AAPL")
+    first = limit("buy", 5, 100.0, user_id="first")
+    second = limit("buy", 5, 100.0, user_id="second")
+    book.submit(first)
+    book.submit(second)
+    fills = book.submit(limit("sell", 5, 100.0))
+    assert [fill["buy_order"] for fill in fills] == [first]
+    assert second.status == "open"
+
+
+def test_fills_at_resting_price():
+    book = OrderBook("AAPL")
+    book.submit(limit("buy", 5, 100.0))
+    fills = book.submit(limit("sell", 5, 95.0))
+    assert fills[0]["price"] == 100.0
+
+
+def test_partial_fill_of_resting_order():
+    book = OrderBook("AAPL")
+    resting = limit("sell", 10, 100.0)
+    book.submit(resting)
+    incoming = limit("buy", 4, 100.0)
+    fills = book.submit(incoming)
+    assert fills[0]["quantity"] == 4
+    assert incoming.status == "filled"
+    assert resting.status == "partially_filled"
+    assert resting.remaining == 6
+    assert book.depth()["asks"] == [{"price": 100.0, "quantity": 6}]
+
+
+def test_partial_fill_of_incoming_order_rests_remainder():
+    book = OrderBook("AAPL")
+    resting = limit("sell", 4, 100.0)
+    book.submit(resting)
+    incoming = limit("buy", 10, 100.0)
+    fills = book.submit(incoming)
+    assert fills[0]["quantity"] == 4
+    assert resting.status == "filled"
+    assert resting.id not in book.resting
+    assert incoming.status == "partially_filled"
+    assert incoming.remaining == 6
+    assert book.depth()["bids"] == [{"price": 100.0, "quantity": 6}]
+    assert book.depth()["asks"] == []
+
+
+def test_sweep_across_levels():
+    book = OrderBook("AAPL")
+    for price in (101.0, 102.0, 103.0):
+        book.submit(limit("sell", 5, price))
+    fills = book.submit(limit("buy", 12, 102.5))
+    assert [(fill["price"], fill["quantity"]) for fill in fills] == [(101.0, 5), (102.0, 5)]
+    assert book.depth()["bids"] == [{"price": 102.5, "quantity": 2}]
+    assert book.depth()["asks"] == [{"price": 103.0, "quantity": 5}]
+
+
+def test_market_order_never_rests():
+    book = OrderBook("AAPL")
+    book.submit(limit("sell", 3, 100.0))
+    order = market("buy", 10)
+    fills = book.submit(order)
+    assert sum(fill["quantity"] for fill in fills) == 3
+    assert order.status == "partially_filled"
+    assert order.id not in book.resting
+    assert book.depth()["bids"] == []
+
+
+def test_market_order_on_empty_book_is_cancelled():
+    book = OrderBook("AAPL")
+    order = market("sell", 10)
+    assert book.submit(order) == []
+    assert order.status == "cancelled"
+    assert book.resting == {}
+
+
+def test_cancelled_order_is_skipped_and_popped_lazily():
+    book = OrderBook("AAPL")
+    cancelled = limit("sell", 5, 100.0)
+    live = limit("sell", 5, 101.0)
+    book.submit(cancelled)
+    book.submit(live)
+    assert book.cancel(cancelled.id) is cancelled
+    assert cancelled.status == "cancelled"
+    assert book.stale_entries == 1
+    assert len(book.asks) == 2
+    assert book.depth()["asks"] == [{"price": 101.0, "quantity": 5}]
+
+    fills = book.submit(limit("buy", 5, 105.0))
+    assert [fill["sell_order"] for fill in fills] == [live]
+    assert book.asks == []
+    assert book.stale_entries == 0
+
+
+def test_cancel_unknown_or_filled_order():
+    book = OrderBook("AAPL")
+    resting = limit("sell", 5, 100.0)
+    book.submit(resting)
+    book.submit(limit("buy", 5, 100.0))
+    assert book.cancel(resting.id) is None
+    assert book.cancel("missing") is None
+
+
+def test_compact_drops_cancelled_entries():
+    book = OrderBook("AAPL")
+    orders = [limit("buy", 1, 100.0 + i / 100) for i in range(1100)]
+    for order in orders:
+        book.submit(order)
+    keep = orders[-10:]
+    for order in orders[:-10]:
+        book.cancel(order.id)
+    # Compaction runs once stale entries pass 1024 and outnumber the live ones
+    assert book.stale_entries < 1024
+    assert len(book.bids) < len(orders)
+    live = [entry[2] for entry in book.bids if entry[2].status != "cancelled"]
+    assert sorted(order.id for order in live) == sorted(order.id for order in keep)
+    fills = book.submit(market("sell", 10))
+    assert [fill["buy_order"] for fill in fills] == list(reversed(keep))
+
+
+def test_depth_aggregates_and_orders_levels():
+    book = OrderBook("AAPL")
+    for quantity, price in ((5, 99.0), (3, 99.0), (2, 98.0), (1, 97.0)):
+        book.submit(limit("buy", quantity, price))
+    for quantity, price in ((4, 101.0), (6, 102.0)):
+        book.submit(limit("sell", quantity, price))
+    depth = book.depth(levels=2)
+    assert depth["bids"] == [{"price": 99.0, "quantity": 8}, {"price": 98.0, "quantity": 2}]
+    assert depth["asks"] == [{"price": 101.0, "quantity": 4}, {"price": 102.0, "quantity": 6}]
+    assert depth["resting_orders"] == 6
+
+
+def test_engine_tracks_resting_orders_for_cancel():
+    engine = MatchingEngine()
+    resting = limit("sell", 5, 100.0)
+    engine.submit(resting)
+    assert engine.order_symbols == {resting.id: "AAPL"}
+    engine.submit(limit("buy", 5, 100.0))
+    assert engine.order_symbols == {}
+    assert engine.cancel(resting.id) is None
+
+    other = limit("buy", 5, 50.0, symbol="MSFT")
+    engine.submit(other)
+    assert engine.cancel(other.id) is other
+    assert engine.books["MSFT"].depth()["bids"] == []
+    assert engine.stats()["fills"] == 1
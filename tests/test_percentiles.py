@@ -0,0 +1,26 @@
+from percentiles import percentile
+
+
+def test_known_ranks():
+    assert percentile([1, 2, 3, 4, 5], 50) == 3
+    assert percentile(list(range(1, 13)), 95) == 12
+    assert percentile(list(range(1, 101)), 99) == 99
+    assert percentile(list(range(1, 101)), 100) == 100
+
+
+def test_lowest_percentile_is_first_sample():
+    assert percentile([7, 8, 9], 0) == 7
+    assert percentile([7, 8, 9], 1) == 7
+
+
+def test_matches_nearest_rank_definition():
+    # Smallest value with at least pct% of the samples at or below it
+    for n in range(1, 200):
+        samples = list(range(1, n + 1))
+        for pct in (1, 5, 25, 50, 75, 90, 95, 99, 99.9):
+            expected = next(value for value in samples if value * 100 >= pct * n)
+            assert percentile(samples, pct) == expected, (n, pct)
+
+
+def test_empty():
+    assert percentile([], 50) == 0.0